@@ -3,6 +3,8 @@
 
 import os
 import logging
+import logging.handlers
+import atexit
 import tempfile
 import shutil
 import random
@@ -10,12 +12,33 @@ import requests
 import time
 import sys
 import re
+import json
+import copy
+import io
+import hashlib
+import contextlib
 import threading
 import unicodedata
-from itertools import cycle
-from flask import Flask, request, jsonify, Response, stream_with_context
+import uuid
+import queue
+import zipfile
+import bisect
+import hmac
+import heapq
+import struct
+import subprocess
+import functools
+from urllib.parse import quote, unquote, unquote_plus, urlencode, urlsplit, urlunsplit
+from collections import OrderedDict, deque
+from itertools import chain, count, cycle, islice
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.wsgi import ClosingIterator, wrap_file
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
 import yt_dlp
+from yt_dlp.utils import DownloadCancelled
+from yt_dlp.utils.networking import HTTPHeaderDict, std_headers
 
 # Proxy rotation sistemi
 PROXY_LIST = [
@@ -67,21 +90,121 @@ def get_rotating_headers():
         'CF-Connecting-IP': f"{random.randint(1,255)}.{random.randint(1,255)}.{random.randint(1,255)}.{random.randint(1,255)}"
     }
 
-# Logging - hem console hem file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('app.log', encoding='utf-8')
-    ]
-)
+# Logging - hem console hem file; yazma işi arka plandaki QueueListener'da
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # text | json
+LOG_FILE = os.environ.get('LOG_FILE', 'app.log')  # boş = sadece stdout
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024))  # 50MB
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN', '')  # örn. 'midnight'; boşsa boyuta göre
+# Tekrarlayan satırlar (strateji hataları): pencere başına ilk LOG_SAMPLE_BURST satır,
+# sonra seviyeye göre her N'de bir satır
+LOG_SAMPLE_WINDOW = int(os.environ.get('LOG_SAMPLE_WINDOW', 60))
+LOG_SAMPLE_BURST = int(os.environ.get('LOG_SAMPLE_BURST', 5))
+LOG_SAMPLE_EVERY = {'DEBUG': 100, 'INFO': 20, 'WARNING': 10}
+
+class JsonFormatter(logging.Formatter):
+    """Satır başına bir JSON nesnesi"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            # Yapısal kayıtlarda (trace) mesaj zaten bu alanların JSON hâli
+            del entry['msg']
+            entry.update(fields)
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            line += f" (+{record.suppressed} similar suppressed)"
+        return line
+
+class SampleFilter(logging.Filter):
+    """extra={'sample_key': ...} taşıyan tekrarlı satırları seyrelt
+
+    Anahtar ve seviye başına pencerede ilk LOG_SAMPLE_BURST satır geçer,
+    sonrasında her LOG_SAMPLE_EVERY[seviye] satırdan biri; atlananların
+    sayısı geçen satıra eklenir. ERROR ve üstü hiç seyreltilmez.
+    """
+
+    def __init__(self, window, burst, every):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.every = every
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        every = self.every.get(record.levelname)
+        if key is None or not every:
+            return True
+        now = time.time()
+        with self.lock:
+            started, seen, suppressed = self.counters.get((record.levelname, key), (now, 0, 0))
+            if now - started > self.window:
+                started, seen = now, 0
+            seen += 1
+            keep = seen <= self.burst or (seen - self.burst) % every == 0
+            if keep:
+                record.suppressed = suppressed
+                suppressed = 0
+            else:
+                suppressed += 1
+            self.counters[(record.levelname, key)] = (started, seen, suppressed)
+            if len(self.counters) > 10000:
+                self.counters.clear()
+        return keep
+
+def setup_logging():
+    """Root logger'a QueueHandler bağla; dosya/stdout yazımı listener thread'inde"""
+    formatter = (JsonFormatter() if LOG_FORMAT == 'json'
+                 else TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        if LOG_ROTATE_WHEN:
+            handlers.append(logging.handlers.TimedRotatingFileHandler(
+                LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'))
+        else:
+            handlers.append(logging.handlers.RotatingFileHandler(
+                LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Seyreltme kuyruğa girmeden, çağıran thread'de yapılır
+    queue_handler.addFilter(SampleFilter(LOG_SAMPLE_WINDOW, LOG_SAMPLE_BURST, LOG_SAMPLE_EVERY))
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Çıkışta kuyrukta kalan satırlar yazılsın
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger(f'{__name__}.trace')
 
 # Startup log
-print("=" * 50)
-print("ReelDrop API Starting with Proxy System...")
-print("=" * 50)
+logger.info("ReelDrop API Starting with Proxy System...")
 
 app = Flask(__name__)
 CORS(app)
@@ -91,6 +214,127 @@ PORT = int(os.environ.get('PORT', 8000))
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
 DOWNLOAD_TIMEOUT = 120  # 2 minutes
 
+# Sonuç cache ayarları (0 = kapalı)
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'reeldrop-cache'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2GB
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 6 * 60 * 60))  # 6 saat
+INFO_CACHE_TTL = int(os.environ.get('INFO_CACHE_TTL', 5 * 60))  # 5 dakika
+
+# Replikalar arası paylaşımlı cache: local (yok) | shared (ortak klasör) | s3
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')
+CACHE_SHARED_DIR = os.environ.get('CACHE_SHARED_DIR', '')
+CACHE_S3_BUCKET = os.environ.get('CACHE_S3_BUCKET', '')
+CACHE_S3_PREFIX = os.environ.get('CACHE_S3_PREFIX', 'reeldrop/')
+CACHE_S3_ENDPOINT = os.environ.get('CACHE_S3_ENDPOINT') or None  # MinIO vb. S3 uyumlu servis
+CACHE_S3_REGION = os.environ.get('CACHE_S3_REGION') or None
+# Anahtar sahipliği: tüm replikaların adresleri (aynı sırada olması gerekmez) ve bu replika
+CACHE_PEERS = [p.strip().rstrip('/') for p in os.environ.get('CACHE_PEERS', '').split(',') if p.strip()]
+CACHE_SELF = os.environ.get('CACHE_SELF', '').rstrip('/')
+CACHE_PEER_TOKEN = os.environ.get('CACHE_PEER_TOKEN', '')  # CACHE_PEERS varsa zorunlu
+CACHE_RING_VNODES = 64
+# Sahibin doldurmasını bekleme süresi; istemcinin DOWNLOAD_TIMEOUT'undan kısa
+# tutulur ki sahip yetişemezse yerel indirmeye zaman kalsın
+CACHE_FILL_TIMEOUT = int(os.environ.get('CACHE_FILL_TIMEOUT', DOWNLOAD_TIMEOUT // 2))
+INFO_TIMEOUT = int(os.environ.get('INFO_TIMEOUT', 30))  # /info extraction süre sınırı
+
+# İndirme scratch alanı: kota, tmpfs seçeneği, yetim klasör temizliği
+SCRATCH_TMPFS = os.environ.get('SCRATCH_TMPFS', '0') == '1'  # /dev/shm altında (RAM)
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR') or os.path.join(
+    '/dev/shm' if SCRATCH_TMPFS and os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    'reeldrop-scratch')
+SCRATCH_QUOTA_BYTES = int(os.environ.get('SCRATCH_QUOTA_BYTES', 4 * 1024 * 1024 * 1024))  # 4GB
+SCRATCH_MIN_FREE_BYTES = int(os.environ.get('SCRATCH_MIN_FREE_BYTES', 512 * 1024 * 1024))  # 512MB
+SCRATCH_SWEEP_INTERVAL = int(os.environ.get('SCRATCH_SWEEP_INTERVAL', 60))
+
+# Kısa link (vm.tiktok.com, t.co, fb.watch) çözümleme cache'i
+SHORT_LINK_TTL = int(os.environ.get('SHORT_LINK_TTL', 24 * 60 * 60))  # 1 gün
+SHORT_LINK_TIMEOUT = 5
+
+# YoutubeDL instance havuzu (0 = her denemede yeni instance)
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 8))
+YDL_POOL_IDLE_TTL = int(os.environ.get('YDL_POOL_IDLE_TTL', 5 * 60))
+
+# Hedged strateji yarışı (opt-in): ilk N stratejinin extraction'ı kademeli başlar
+HEDGE_STRATEGIES = os.environ.get('HEDGE_STRATEGIES', '0') == '1'
+HEDGE_WIDTH = int(os.environ.get('HEDGE_WIDTH', 3))  # istek başına eşzamanlı extraction
+HEDGE_DELAY = float(os.environ.get('HEDGE_DELAY', 2.0))  # başlangıçlar arası bekleme (sn)
+HEDGE_PLATFORM_LIMIT = int(os.environ.get('HEDGE_PLATFORM_LIMIT', 8))  # platform başına ek extraction
+
+# Segmentli (HLS/DASH) formatlarda eşzamanlı fragment indirme, platform başına
+FRAGMENT_CONCURRENCY = {
+    platform: int(os.environ.get(f'FRAGMENT_CONCURRENCY_{platform.upper()}', default))
+    for platform, default in (('youtube', 4), ('instagram', 4), ('facebook', 4),
+                              ('tiktok', 4), ('twitter', 4), ('generic', 2))
+}
+
+# Tüm indirmelerin paylaştığı bant genişliği (bayt/sn, 0 = sınırsız)
+BANDWIDTH_LIMIT = int(os.environ.get('BANDWIDTH_LIMIT', 0))
+BANDWIDTH_MAX_SLEEP = 1.0  # hook başına; kalan borç sonraki hook'a devreder
+
+# İndirme sürerken istemciye akıtma (istekte 'stream' alanı ile de seçilebilir)
+STREAM_PASSTHROUGH = os.environ.get('STREAM_PASSTHROUGH', '0') == '1'
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# sendfile yoksa file_wrapper okuma bloğu
+SEND_BUFFER_SIZE = 256 * 1024
+# Range başlığında kabul edilen en fazla aralık; fazlası tüm dosyayı alır
+MAX_BYTE_RANGES = 16
+
+# İndirme sonrası MP4 moov atomunu başa taşı (oynatma ilk KB'larda başlasın)
+FASTSTART = os.environ.get('FASTSTART', '1') == '1'
+FASTSTART_MAX_MOOV = int(os.environ.get('FASTSTART_MAX_MOOV', 64 * 1024 * 1024))
+FASTSTART_TIMEOUT = int(os.environ.get('FASTSTART_TIMEOUT', 60))  # ffmpeg yedeği için
+
+# Toplu indirme (/download/batch)
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 20))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))  # batch başına eşzamanlı iş
+
+# İndirme fazı kapısı: extraction'ı biten işler en kısa tahmini süreden başlar
+# Slot sayısı worker'dan azken diğer worker'lar extraction'a devam eder, kısa
+# videolar kapıda uzunların önüne geçer. SJF_AGING: beklenen her saniye
+# tahmini süreden bu kadar saniye düşer (uzun işler aç kalmaz).
+# Eşzamanlı indirme sayısı varsayılan olarak eskisiyle aynı (JOB_WORKERS ya da 4);
+# worker sayısı onun iki katı, fazlası yalnızca extraction yapar.
+# Yalnızca thread modunda (app:app); ASGI modunda kapı kullanılmaz (bkz. asgi.py).
+DOWNLOAD_SLOTS = int(os.environ.get('DOWNLOAD_SLOTS', os.environ.get('JOB_WORKERS', 4)))
+SJF_AGING = float(os.environ.get('SJF_AGING', 1.0))
+SJF_ASSUMED_BPS = int(os.environ.get('SJF_ASSUMED_BPS', 2 * 1024 * 1024))  # boyuttan süre tahmini
+SJF_DEFAULT_COST = 30.0  # süre ve boyut bilinmiyorsa (sn)
+
+# Asenkron iş ayarları
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2 * DOWNLOAD_SLOTS))
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 16))
+JOB_TTL = int(os.environ.get('JOB_TTL', 15 * 60))  # 15 dakika
+
+# İstemci başına token bucket (X-API-Key, yoksa IP); CLIENT_RATE=0 kapatır
+CLIENT_RATE = float(os.environ.get('CLIENT_RATE', 0.5))  # token/sn
+CLIENT_BURST = int(os.environ.get('CLIENT_BURST', 10))
+# Anahtara özel kota ve kuyruk ağırlığı: {"anahtar": {"rate": 2, "burst": 20, "weight": 4}}
+API_KEYS = json.loads(os.environ.get('API_KEYS') or '{}')
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))  # X-Forwarded-For'a ekleyen proxy sayısı
+RATE_LIMIT_MAX_CLIENTS = 10000
+
+# Bu süreden eski, sahibi bilinmeyen scratch klasörleri silinir
+SCRATCH_ORPHAN_TTL = int(os.environ.get('SCRATCH_ORPHAN_TTL', JOB_TTL + 2 * DOWNLOAD_TIMEOUT))
+
+# Prometheus metrikleri (/metrics)
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+EXTRACTION_SECONDS = Histogram('reeldrop_extraction_seconds', 'Metadata extraction time',
+                               ['platform', 'strategy'], buckets=LATENCY_BUCKETS)
+DOWNLOAD_SECONDS = Histogram('reeldrop_download_seconds', 'Media download time',
+                             ['platform', 'strategy'], buckets=LATENCY_BUCKETS)
+STREAM_SECONDS = Histogram('reeldrop_stream_seconds', 'Time spent sending the response body',
+                           ['platform', 'mode'], buckets=LATENCY_BUCKETS)
+STRATEGY_ATTEMPTS = Counter('reeldrop_strategy_attempts_total', 'Strategy attempts',
+                            ['platform', 'strategy'])
+STRATEGY_FAILURES = Counter('reeldrop_strategy_failures_total', 'Failed strategy attempts',
+                            ['platform', 'strategy'])
+BYTES_SERVED = Counter('reeldrop_bytes_served_total', 'Response body bytes sent to clients')
+DOWNLOAD_TIMEOUTS = Counter('reeldrop_download_timeouts_total', 'Downloads that hit DOWNLOAD_TIMEOUT',
+                            ['platform'])
+DOWNLOADS_IN_FLIGHT = Gauge('reeldrop_downloads_in_flight', 'Downloads currently running',
+                            multiprocess_mode='livesum')
+
 USER_AGENTS = [
     'Mozilla/5.0 (iPhone; CPU iPhone OS 15_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.6 Mobile/15E148 Safari/604.1',
     'Mozilla/5.0 (Linux; Android 12; SM-G973F) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Mobile Safari/537.36',
@@ -100,6 +344,24 @@ USER_AGENTS = [
 class TimeoutError(Exception):
     pass
 
+class PoolSaturated(Exception):
+    """İndirme kuyruğu dolu; retry_after saniye sonra tekrar denenmeli"""
+    def __init__(self, retry_after):
+        super().__init__(f"Download queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class RateLimited(Exception):
+    """İstemci kotasını aştı; retry_after saniye sonra token birikir (429)"""
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class StorageFull(PoolSaturated):
+    """Scratch kotası dolu ya da diskte yer kalmadı"""
+
+class FormatTooLarge(Exception):
+    """Bütçeye uyan format yok; medya indirilmeden reddedilir (413)"""
+
 def clean_filename(title):
     """Dosya adını temizle"""
     if not title:
@@ -121,72 +383,2232 @@ def clean_filename(title):
     
     return title[:40] if title else "video"
 
+# Uzantı -> MIME; sniff_media ve uzantıdan tahmin için
+MEDIA_TYPES = {
+    'mp4': 'video/mp4',
+    'm4a': 'audio/mp4',
+    'mov': 'video/quicktime',
+    '3gp': 'video/3gpp',
+    'webm': 'video/webm',
+    'mkv': 'video/x-matroska',
+    'flv': 'video/x-flv',
+    'ts': 'video/mp2t',
+    'avi': 'video/x-msvideo',
+    'ogg': 'audio/ogg',
+    'mp3': 'audio/mpeg'
+}
+
+def media_type_for(path):
+    """Dosya uzantısından (uzantı, MIME); bilinmiyorsa mp4 varsayılır"""
+    ext = os.path.splitext(path)[1].lstrip('.').lower()
+    if ext not in MEDIA_TYPES:
+        ext = 'mp4'
+    return ext, MEDIA_TYPES[ext]
+
+def sniff_media(f):
+    """Açık dosyanın başlığından gerçek kapsayıcıyı bul: (uzantı, MIME) ya da None"""
+    pos = f.tell()
+    try:
+        f.seek(0)
+        head = f.read(256)
+    finally:
+        f.seek(pos)
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand == b'qt  ':
+            ext = 'mov'
+        elif brand in (b'M4A ', b'M4B '):
+            ext = 'm4a'
+        elif brand.startswith(b'3g'):
+            ext = '3gp'
+        else:
+            ext = 'mp4'
+    elif head.startswith(b'\x1a\x45\xdf\xa3'):
+        ext = 'webm' if b'webm' in head else 'mkv'
+    elif head.startswith(b'FLV'):
+        ext = 'flv'
+    elif head.startswith(b'RIFF') and head[8:12] == b'AVI ':
+        ext = 'avi'
+    elif head.startswith(b'OggS'):
+        ext = 'ogg'
+    elif len(head) > 188 and head[0] == head[188] == 0x47:
+        # 188 baytlık paketlerin sync baytı
+        ext = 'ts'
+    elif head.startswith(b'ID3') or head[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        ext = 'mp3'
+    else:
+        return None
+    return ext, MEDIA_TYPES[ext]
+
+def _atoms(f, start, end):
+    """[start, end) aralığındaki ISO BMFF kutuları: (tip, başlangıç, başlık boyu, toplam boy)"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"Corrupt atom {kind!r} at {pos}")
+        yield kind, pos, header, size
+        pos += size
+
+# stco/co64 barındıran kapsayıcı kutular
+_MOOV_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+def _shift_chunk_offsets(moov, shift):
+    """moov içindeki tüm stco/co64 chunk offset'lerini shift kadar kaydır"""
+    def walk(start, end):
+        pos = start
+        while pos + 8 <= end:
+            size, kind = struct.unpack_from('>I4s', moov, pos)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', moov, pos + 8)[0]
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header or pos + size > end:
+                raise ValueError(f"Corrupt atom {kind!r} in moov")
+            body = pos + header
+            if kind in _MOOV_CONTAINERS:
+                walk(body, pos + size)
+            elif kind == b'cmov':
+                raise ValueError("Compressed moov")
+            elif kind in (b'stco', b'co64'):
+                # version/flags (4) + entry sayısı (4)
+                count = struct.unpack_from('>I', moov, body + 4)[0]
+                fmt, width = ('>I', 4) if kind == b'stco' else ('>Q', 8)
+                for i in range(count):
+                    at = body + 8 + i * width
+                    value = struct.unpack_from(fmt, moov, at)[0] + shift
+                    if kind == b'stco' and value > 0xFFFFFFFF:
+                        raise ValueError("stco offset overflow")
+                    struct.pack_into(fmt, moov, at, value)
+            pos += size
+    walk(8 if struct.unpack_from('>I', moov)[0] != 1 else 16, len(moov))
+
+def faststart_mp4(path):
+    """moov kutusu mdat'tan sonraysa başa taşı (yerinde, atomik rename)
+
+    Saf Python: kutular yeniden sıralanır, chunk offset'leri moov boyu kadar
+    kaydırılır. Desteklenmeyen dosyada ffmpeg varsa -c copy +faststart
+    denenir. Dönüş: dosya yeniden yazıldıysa True.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        atoms = list(_atoms(f, 0, size))
+        kinds = [a[0] for a in atoms]
+        if b'moov' not in kinds or b'mdat' not in kinds:
+            return False
+        moov_index = kinds.index(b'moov')
+        mdat_index = kinds.index(b'mdat')
+        if moov_index < mdat_index:
+            return False  # zaten fast-start
+        _, moov_pos, _, moov_size = atoms[moov_index]
+        if moov_size > FASTSTART_MAX_MOOV:
+            raise ValueError(f"moov too large ({moov_size} bytes)")
+        f.seek(moov_pos)
+        moov = bytearray(f.read(moov_size))
+        _shift_chunk_offsets(moov, moov_size)
+        
+        tmp = f'{path}.faststart'
+        try:
+            with open(tmp, 'wb') as out:
+                for index, (kind, pos, _, atom_size) in enumerate(atoms):
+                    if index == mdat_index:
+                        out.write(moov)
+                    if index == moov_index:
+                        continue
+                    f.seek(pos)
+                    remaining = atom_size
+                    while remaining:
+                        chunk = f.read(min(SEND_BUFFER_SIZE, remaining))
+                        if not chunk:
+                            raise ValueError("Unexpected end of file")
+                        out.write(chunk)
+                        remaining -= len(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+    return True
+
+def _ffmpeg_faststart(path):
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return False
+    root, ext = os.path.splitext(path)
+    tmp = f'{root}.faststart{ext}'
+    try:
+        subprocess.run([ffmpeg, '-y', '-v', 'error', '-i', path, '-map', '0', '-c', 'copy',
+                        '-movflags', '+faststart', tmp],
+                       check=True, capture_output=True, timeout=FASTSTART_TIMEOUT)
+        os.replace(tmp, path)
+        return True
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"ffmpeg faststart failed for {path}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+def postprocess_media(file_path):
+    """İndirilen dosya: gerçek kapsayıcıya göre uzantıyı düzelt, MP4'ü fast-start yap
+
+    Yeni dosya yolunu döndürür; hata olursa dosya olduğu gibi bırakılır.
+    """
+    with open(file_path, 'rb') as f:
+        sniffed = sniff_media(f)
+    if sniffed is None:
+        return file_path
+    ext = sniffed[0]
+    if FASTSTART and ext in ('mp4', 'm4a', 'mov', '3gp'):
+        try:
+            if faststart_mp4(file_path):
+                logger.info(f"Moved moov atom to front: {os.path.basename(file_path)}")
+        except (OSError, ValueError, struct.error) as e:
+            logger.info(f"Pure-Python faststart skipped ({e}), trying ffmpeg")
+            _ffmpeg_faststart(file_path)
+    root, current = os.path.splitext(file_path)
+    if current.lstrip('.').lower() != ext:
+        fixed = f'{root}.{ext}'
+        os.replace(file_path, fixed)
+        return fixed
+    return file_path
+
+# Host soneki -> platform (alt alan adları da eşleşir: m.youtube.com, vm.tiktok.com)
+PLATFORM_HOSTS = {
+    'youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'youtube-nocookie.com': 'youtube',
+    'instagram.com': 'instagram',
+    'instagr.am': 'instagram',
+    'facebook.com': 'facebook',
+    'fb.com': 'facebook',
+    'fb.watch': 'facebook',
+    'tiktok.com': 'tiktok',
+    'twitter.com': 'twitter',
+    'x.com': 'twitter',
+    't.co': 'twitter'
+}
+
+@functools.lru_cache(maxsize=1024)
+def match_extractor(url):
+    """URL'ye uyan yt_dlp extractor'ını bul (ağ isteği yapmaz)"""
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.ie_key() == 'Generic':
+            continue
+        if ie.suitable(url):
+            return ie
+    return None
+
+def url_host(url):
+    """URL'nin küçük harfli host'u; şemasız 'www.' adresleri de çözülür"""
+    if '://' not in url:
+        url = '//' + url
+    try:
+        return (urlsplit(url.strip()).hostname or '').rstrip('.')
+    except ValueError:
+        return ''
+
+def detect_platform(url):
+    """Host'u sonek tablosunda ara; bilinmeyenler için 'generic'"""
+    labels = url_host(url).split('.')
+    for i in range(len(labels) - 1):
+        platform = PLATFORM_HOSTS.get('.'.join(labels[i:]))
+        if platform:
+            return platform
+    return 'generic'
+
+def route_url(url):
+    """(platform, ie_key): bilinmeyen host'lar için tek bir extractor seçilir"""
+    platform = detect_platform(url)
+    if platform != 'generic':
+        return platform, None
+    ie = match_extractor(url)
+    return platform, ie.ie_key() if ie else 'Generic'
+
+class FormatBudget:
+    """İstemcinin bayt/yükseklik bütçesi; info dict'ten sığan en iyi formatı seçer
+
+    Boyut filesize, filesize_approx ya da tbr x süre tahmininden gelir.
+    MAX_CONTENT_LENGTH her zaman üst sınırdır.
+    """
+
+    def __init__(self, max_bytes=None, max_height=None):
+        self.max_bytes = min(max_bytes or MAX_CONTENT_LENGTH, MAX_CONTENT_LENGTH)
+        self.max_height = max_height
+
+    @classmethod
+    def from_request(cls, data):
+        """(bütçe ya da None, hata) döndür"""
+        values = {}
+        for name in ('max_bytes', 'max_height'):
+            value = data.get(name)
+            if value in (None, ''):
+                continue
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                value = 0
+            if value <= 0:
+                return None, f'{name} must be a positive integer'
+            values[name] = value
+        return (cls(**values) if values else None), None
+
+    def __repr__(self):
+        return f"{self.max_bytes} bytes, " + (f"{self.max_height}p" if self.max_height else "any height")
+
+    def key(self):
+        return f'{self.max_bytes}:{self.max_height or ""}'
+
+    @staticmethod
+    def estimate_size(f, duration):
+        size = f.get('filesize') or f.get('filesize_approx')
+        if not size and f.get('tbr') and duration:
+            size = int(f['tbr'] * 125 * duration)  # tbr kbit/s
+        return size
+
+    def select(self, info):
+        """Bütçeye sığan en yüksek çözünürlüklü tek dosyalı formatı döndür
+
+        Boyutu bilinmeyenler yalnızca boyutu bilinen aday yoksa seçilir
+        (max_filesize indirme sırasında yine korur). Aday yoksa FormatTooLarge.
+        """
+        duration = info.get('duration')
+        fitting, unknown = [], []
+        smallest = None
+        for f in info.get('formats') or [info]:
+            # Birleştirme gerektiren video-only/audio-only parçalar atlanır
+            if f.get('vcodec') == 'none' or f.get('acodec') == 'none':
+                continue
+            if self.max_height and f.get('height') and f['height'] > self.max_height:
+                continue
+            size = self.estimate_size(f, duration)
+            if size is None:
+                unknown.append(f)
+            elif size <= self.max_bytes:
+                fitting.append(f)
+            else:
+                smallest = size if smallest is None else min(smallest, size)
+        candidates = fitting or unknown
+        if not candidates:
+            detail = f', smallest is {smallest} bytes' if smallest else ''
+            raise FormatTooLarge(f"No format fits the budget ({self!r}{detail})")
+        return max(candidates, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0,
+                                              self.estimate_size(f, duration) or 0))
+
+def video_cache_key(url, quality, budget=None):
+    """(extractor, video id, format) üçlüsünden cache anahtarı üret"""
+    ie = match_extractor(url)
+    video_id = ie.get_temp_id(url) if ie else None
+    if video_id:
+        extractor = ie.ie_key()
+    else:
+        # ID çıkarılamıyorsa URL'nin kendisi kimlik olur
+        extractor, video_id = 'Generic', url.strip()
+    if detect_platform(url) in SimpleDownloader.HANDLERS:
+        # Platform handler'ları kendi format stratejilerini kullanır, quality'yi yok sayar
+        quality = ''
+    raw = f"{extractor}:{video_id}:{quality or ''}"
+    if budget is not None:
+        raw += f":{budget.key()}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class Trace:
+    """İstek ve indirme fazları için hafif span kaydedici
+
+    Span'ler (ad, başlangıç epoch, süre, açıklama) olarak tutulur; mutlak
+    zaman sayesinde alt process'lerden gelen span'ler de birleştirilebilir.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+
+    @contextlib.contextmanager
+    def span(self, name, desc=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time() - start, desc)
+
+    def add(self, name, start, duration, desc=None):
+        with self.lock:
+            self.spans.append((name, start, duration, desc))
+
+    def extend(self, spans):
+        with self.lock:
+            self.spans.extend(spans)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.spans)
+
+def server_timing(spans, total):
+    """Span listesinden Server-Timing header değeri"""
+    parts = []
+    for name, _, duration, desc in sorted(spans, key=lambda span: span[1]):
+        entry = name
+        if desc:
+            desc = str(desc).encode('ascii', 'replace').decode().replace('\\', '').replace('"', "'")
+            entry += f';desc="{desc}"'
+        parts.append(f'{entry};dur={duration * 1000:.1f}')
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+def log_trace(request_id, started, spans, **fields):
+    """İstek başına tek satır JSON trace"""
+    record = {'request_id': request_id, **fields,
+              'total_ms': round((time.time() - started) * 1000, 1), 'spans': []}
+    for name, start, duration, desc in sorted(spans, key=lambda span: span[1]):
+        span = {'name': name, 'start_ms': round((start - started) * 1000, 1),
+                'dur_ms': round(duration * 1000, 1)}
+        if desc:
+            span['desc'] = desc
+        record['spans'].append(span)
+    trace_logger.info(json.dumps(record, ensure_ascii=False), extra={'fields': {'trace': record}})
+
+class ResultCache:
+    """İndirilen dosyalar için disk tabanlı LRU/TTL cache"""
+
+    def __init__(self, root, max_bytes, ttl):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            os.makedirs(self.root, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _paths(self, key):
+        return os.path.join(self.root, f'{key}.data'), os.path.join(self.root, f'{key}.json')
+
+    def _load(self):
+        """Yeniden başlatmada diskteki kayıtları index'e al"""
+        metas = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if '.tmp-' in name:
+                # Yarım kalmış atomik yazma
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                data_path, _ = self._paths(meta['key'])
+                meta['size'] = os.path.getsize(data_path)
+                # Erişim zamanı meta dosyasında; veri dosyasının mtime'ı ETag'e girer
+                meta['accessed'] = os.path.getmtime(path)
+                metas.append(meta)
+            except (OSError, ValueError, KeyError):
+                continue
+        for meta in sorted(metas, key=lambda m: m['accessed']):
+            self.entries[meta['key']] = meta
+            self.total_bytes += meta['size']
+        with self.lock:
+            self._evict()
+
+    def _remove(self, key):
+        meta = self.entries.pop(key, None)
+        if meta:
+            self.total_bytes -= meta['size']
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, m in self.entries.items() if now - m['created'] > self.ttl]:
+            self._remove(key)
+        while self.total_bytes > self.max_bytes and self.entries:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+
+    def get(self, key):
+        """Geçerli kayıt varsa (dosya yolu, başlık) döndür"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            meta = self.entries.get(key)
+            if meta and time.time() - meta['created'] > self.ttl:
+                self._remove(key)
+                meta = None
+            data_path, meta_path = self._paths(key)
+            if meta and not os.path.exists(data_path):
+                self._remove(key)
+                meta = None
+            if not meta:
+                self.misses += 1
+                return None
+            meta['accessed'] = time.time()
+            self.entries.move_to_end(key)
+            self.hits += 1
+        try:
+            # LRU sırası yeniden başlatmada korunsun; veri dosyasına dokunulmaz (ETag sabit kalır)
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return data_path, meta['title']
+
+    def put(self, key, file_path, title):
+        """Dosyayı cache'e taşı, yeni yolunu döndür (sığmazsa None)"""
+        if not self.enabled:
+            return None
+        size = os.path.getsize(file_path)
+        if size > self.max_bytes:
+            return None
+        data_path, meta_path = self._paths(key)
+        suffix = f'.tmp-{os.getpid()}-{threading.get_ident()}'
+        try:
+            # Önce geçici isme yaz, sonra atomik rename
+            shutil.move(file_path, data_path + suffix)
+            os.replace(data_path + suffix, data_path)
+            now = time.time()
+            meta = {'key': key, 'title': title, 'size': size, 'created': now, 'accessed': now}
+            with open(meta_path + suffix, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + suffix, meta_path)
+        except OSError as e:
+            logger.warning(f"Cache write failed for {key}: {e}")
+            for path in (data_path + suffix, meta_path + suffix):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return None
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_bytes -= old['size']
+            self.entries[key] = meta
+            self.total_bytes += size
+            self._evict()
+        return data_path
+
+    def stats(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES, CACHE_TTL)
+
+class ScratchStore:
+    """İndirme klasörleri için yönetilen scratch alanı
+
+    Her iş kendi job-<pid>-* klasörünü alır. Janitor thread'i sahibi
+    ölmüş process'lerin ve orphan_ttl'den eski sahipsiz klasörleri siler;
+    yeni indirmeler kota ya da boş alan eşiği aşılınca reddedilir.
+    """
+
+    def __init__(self, root, quota, min_free, orphan_ttl, sweep_interval):
+        self.root = root
+        self.quota = quota
+        self.min_free = min_free
+        self.orphan_ttl = orphan_ttl
+        self.sweep_interval = sweep_interval
+        self.lock = threading.Lock()
+        self.live = set()
+        self.swept = 0
+        self.rejected = 0
+        self.janitor = None
+
+    def usage(self):
+        """Scratch altındaki toplam bayt"""
+        total = 0
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def admit(self):
+        """Yer yoksa StorageFull fırlat"""
+        os.makedirs(self.root, exist_ok=True)
+        free = shutil.disk_usage(self.root).free
+        reason = None
+        if free < self.min_free:
+            reason = f"only {free // (1024 * 1024)}MB free"
+        elif self.quota and self.usage() >= self.quota:
+            reason = "scratch quota exhausted"
+        if reason:
+            with self.lock:
+                self.rejected += 1
+            logger.warning(f"Scratch admission rejected: {reason}")
+            raise StorageFull(self.sweep_interval)
+
+    def create(self):
+        self._start_janitor()
+        self.admit()
+        path = tempfile.mkdtemp(prefix=f'job-{os.getpid()}-', dir=self.root)
+        with self.lock:
+            self.live.add(path)
+        return path
+
+    def release(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        with self.lock:
+            self.live.discard(path)
+
+    def adopt(self, path):
+        """Başka process'in oluşturduğu klasörü sahiplen (janitor dokunmasın)"""
+        with self.lock:
+            self.live.add(path)
+
+    def detach(self, path):
+        """Klasörü başka process'e devret; silmeden takibi bırak"""
+        with self.lock:
+            self.live.discard(path)
+
+    @staticmethod
+    def _owner_alive(name):
+        try:
+            pid = int(name.split('-')[1])
+        except (IndexError, ValueError):
+            return False
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def sweep(self):
+        """Yetim klasörleri sil: sahibi ölmüş ya da orphan_ttl'den eski"""
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return 0
+        now = time.time()
+        removed = 0
+        for entry in entries:
+            if not entry.name.startswith('job-'):
+                continue
+            with self.lock:
+                if entry.path in self.live:
+                    continue
+            try:
+                age = now - entry.stat().st_mtime
+            except OSError:
+                continue
+            if not self._owner_alive(entry.name) or age > self.orphan_ttl:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"Scratch janitor removed {removed} orphaned directories")
+            with self.lock:
+                self.swept += removed
+        return removed
+
+    def _start_janitor(self):
+        with self.lock:
+            if self.janitor is not None or self.sweep_interval <= 0:
+                return
+            self.janitor = threading.Thread(target=self._janitor, name='scratch-janitor', daemon=True)
+        self.janitor.start()
+
+    def _janitor(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"Scratch janitor failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def stats(self):
+        try:
+            free = shutil.disk_usage(self.root).free
+        except OSError:
+            free = None
+        with self.lock:
+            live, swept, rejected = len(self.live), self.swept, self.rejected
+        return {
+            'root': self.root,
+            'tmpfs': self.root.startswith('/dev/shm'),
+            'quota_bytes': self.quota,
+            'used_bytes': self.usage(),
+            'free_bytes': free,
+            'min_free_bytes': self.min_free,
+            'live': live,
+            'swept': swept,
+            'rejected': rejected
+        }
+
+scratch = ScratchStore(SCRATCH_DIR, SCRATCH_QUOTA_BYTES, SCRATCH_MIN_FREE_BYTES,
+                       SCRATCH_ORPHAN_TTL, SCRATCH_SWEEP_INTERVAL)
+
+class SharedDirBackend:
+    """Replikaların ortak bağladığı klasör (NFS, volume); yazma atomik rename ile"""
+
+    name = 'shared'
+    SWEEP_INTERVAL = 10 * 60
+
+    def __init__(self, root, ttl):
+        if not root:
+            raise ValueError("CACHE_SHARED_DIR is required for the shared cache backend")
+        self.root = root
+        self.ttl = ttl
+        self.last_sweep = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, key):
+        folder = os.path.join(self.root, key[:2])
+        return folder, os.path.join(folder, f'{key}.data'), os.path.join(folder, f'{key}.json')
+
+    def _meta(self, key):
+        _, data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - meta.get('created', 0) > self.ttl or not os.path.exists(data_path):
+            return None
+        return meta
+
+    def exists(self, key):
+        return self._meta(key) is not None
+
+    def fetch(self, key, dest):
+        """Nesneyi dest'e kopyala, başlığı döndür (yoksa None)"""
+        meta = self._meta(key)
+        if meta is None:
+            return None
+        shutil.copyfile(self._paths(key)[1], dest)
+        return meta['title']
+
+    def store(self, key, f, title):
+        folder, data_path, meta_path = self._paths(key)
+        os.makedirs(folder, exist_ok=True)
+        suffix = f'.tmp-{uuid.uuid4().hex}'
+        try:
+            with open(data_path + suffix, 'wb') as out:
+                shutil.copyfileobj(f, out, SEND_BUFFER_SIZE)
+            os.replace(data_path + suffix, data_path)
+            # Meta en son yazılır; okuyan taraf meta varsa verinin tamam olduğunu bilir
+            with open(meta_path + suffix, 'w', encoding='utf-8') as out:
+                json.dump({'key': key, 'title': title, 'created': time.time()}, out)
+            os.replace(meta_path + suffix, meta_path)
+        finally:
+            for path in (data_path + suffix, meta_path + suffix):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._sweep()
+
+    def _sweep(self):
+        """Süresi dolan kayıtları sil (arada bir, herhangi bir replika yapabilir)"""
+        now = time.time()
+        if now - self.last_sweep < self.SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl + self.SWEEP_INTERVAL:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+class S3Backend:
+    """S3 uyumlu nesne deposu (AWS, MinIO, R2); boto3 yalnızca bu backend seçilince gerekir"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix, ttl, endpoint=None, region=None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=s3 requires boto3 (pip install boto3)") from e
+        if not bucket:
+            raise ValueError("CACHE_S3_BUCKET is required for the s3 cache backend")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl = ttl
+        self.client = boto3.client('s3', endpoint_url=endpoint, region_name=region)
+        self.client_error = self.client.exceptions.ClientError
+
+    def _missing(self, error):
+        """Yalnızca 404 miss sayılır; yetki ve diğer hatalar yukarı çıkar"""
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def _head(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.client_error as e:
+            if self._missing(e):
+                return None
+            raise
+        # Silme işi bucket lifecycle kuralına kalır; burada yalnızca bayat sayılır
+        if time.time() - head['LastModified'].timestamp() > self.ttl:
+            return None
+        return head
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def fetch(self, key, dest):
+        head = self._head(key)
+        if head is None:
+            return None
+        try:
+            self.client.download_file(self.bucket, self.prefix + key, dest)
+        except self.client_error as e:
+            # head ile indirme arasında silinmiş olabilir
+            if self._missing(e):
+                return None
+            raise
+        return unquote(head.get('Metadata', {}).get('title', 'video'))
+
+    def store(self, key, f, title):
+        # Metadata yalnızca ASCII taşır
+        self.client.upload_fileobj(f, self.bucket, self.prefix + key,
+                                   ExtraArgs={'Metadata': {'title': quote(title)}})
+
+def make_cache_backend(kind):
+    """CACHE_BACKEND değerinden paylaşımlı backend; 'local' için None"""
+    if kind == 'shared':
+        return SharedDirBackend(CACHE_SHARED_DIR, CACHE_TTL)
+    if kind == 's3':
+        return S3Backend(CACHE_S3_BUCKET, CACHE_S3_PREFIX, CACHE_TTL,
+                         CACHE_S3_ENDPOINT, CACHE_S3_REGION)
+    if kind != 'local':
+        raise ValueError(f"Unknown CACHE_BACKEND: {kind}")
+    return None
+
+class HashRing:
+    """Sanal düğümlü consistent hash; replika eklenip çıkınca anahtarların azı yer değiştirir"""
+
+    def __init__(self, nodes, vnodes=CACHE_RING_VNODES):
+        self.nodes = sorted(set(nodes))
+        self.ring = sorted((self._hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self.points = [point for point, _ in self.ring]
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.sha1(value.encode('utf-8')).hexdigest()[:16], 16)
+
+    def owner(self, key):
+        if not self.ring:
+            return None
+        index = bisect.bisect(self.points, self._hash(key)) % len(self.ring)
+        return self.ring[index][1]
+
+class SharedCache:
+    """Yerel ResultCache'in arkasındaki replikalar arası katman
+
+    Yerel cache'te olmayan anahtar önce paylaşımlı backend'de aranır. Orada
+    da yoksa anahtarın sahibi (hash ring) başka bir replikaysa ondan
+    /cache/fill ile doldurması istenir; böylece aynı video replika sayısı
+    kadar değil bir kez indirilir. Sahip cevap vermezse yerelde indirilir.
+    """
+
+    def __init__(self, backend, ring, self_url, token=''):
+        self.backend = backend
+        self.ring = ring
+        self.self_url = self_url
+        self.token = token
+        self.lock = threading.Lock()
+        self.uploads = {}  # anahtar -> bitince set edilen Event
+        self.session = requests.Session()
+        self.counters = dict.fromkeys(('hits', 'misses', 'read_errors', 'stores', 'store_errors',
+                                       'fills_requested', 'fills_ok', 'fills_failed', 'fills_served'), 0)
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def owner(self, key):
+        """Anahtarın sahibi başka replikaysa adresi, bizsek ya da ring yoksa None"""
+        owner = self.ring.owner(key)
+        return None if owner in (None, self.self_url) else owner
+
+    def load(self, key):
+        """Backend'deki nesneyi yerele indir: (yol, başlık, temp klasör) ya da None"""
+        if result_cache.enabled:
+            os.makedirs(result_cache.root, exist_ok=True)
+            dest = os.path.join(result_cache.root, f'{key}.tmp-{uuid.uuid4().hex}')
+            temp_dir = None
+        else:
+            temp_dir = scratch.create()
+            dest = os.path.join(temp_dir, f'{key}.data')
+        try:
+            title = self.backend.fetch(key, dest)
+        except Exception as e:
+            # Okunamayan backend indirmeyi durdurmaz, ama miss'ten ayrı sayılır
+            self._count('read_errors')
+            logger.error(f"Shared cache read failed for {key}: {e}")
+            title = None
+        if title is None:
+            self._count('misses')
+            if temp_dir:
+                scratch.release(temp_dir)
+            else:
+                try:
+                    os.remove(dest)
+                except OSError:
+                    pass
+            return None
+        self._count('hits')
+        if temp_dir:
+            return dest, title, temp_dir
+        cached_path = result_cache.put(key, dest, title)
+        if cached_path:
+            return cached_path, title, None
+        # Yerel cache'e sığmadı; scratch'e taşı
+        temp_dir = scratch.create()
+        path = os.path.join(temp_dir, f'{key}.data')
+        shutil.move(dest, path)
+        return path, title, temp_dir
+
+    def _store(self, key, f, title):
+        try:
+            with f:
+                self.backend.store(key, f, title)
+            self._count('stores')
+        except Exception as e:
+            self._count('store_errors')
+            logger.warning(f"Shared cache write failed for {key}: {e}")
+
+    def store_async(self, key, file_path, title):
+        """Dosyayı arka planda backend'e yaz
+
+        Dosya hemen açılır: yanıt bitip temp klasör silinse de açık
+        descriptor üzerinden yükleme sürer.
+        """
+        f = open(file_path, 'rb')
+        done = threading.Event()
+        with self.lock:
+            self.uploads[key] = done
+
+        def run():
+            try:
+                self._store(key, f, title)
+            finally:
+                with self.lock:
+                    if self.uploads.get(key) is done:
+                        del self.uploads[key]
+                done.set()
+
+        threading.Thread(target=run, name=f'cache-upload-{key[:8]}', daemon=True).start()
+        return done
+
+    def ensure_stored(self, key, file_path, title, timeout=CACHE_FILL_TIMEOUT):
+        """Nesne backend'de yoksa yazdır ve en fazla timeout kadar bekle"""
+        with self.lock:
+            pending = self.uploads.get(key)
+        if pending is None:
+            if self.backend.exists(key):
+                return True
+            pending = self.store_async(key, file_path, title)
+        if not pending.wait(timeout):
+            raise TimeoutError("Shared cache upload still running")
+        return self.backend.exists(key)
+
+    def request_fill(self, owner, url, quality, budget=None):
+        """Sahip replikadan anahtarı doldurmasını iste; FormatTooLarge sahipten de gelir"""
+        self._count('fills_requested')
+        body = {'url': url, 'quality': quality}
+        if budget is not None:
+            body.update(max_bytes=budget.max_bytes, max_height=budget.max_height)
+        try:
+            response = self.session.post(f'{owner}/cache/fill', json=body,
+                                         headers={'X-Cache-Token': self.token},
+                                         timeout=CACHE_FILL_TIMEOUT)
+        except requests.RequestException as e:
+            self._count('fills_failed')
+            logger.warning(f"Cache fill request to {owner} failed: {e}")
+            return False
+        if response.status_code == 413:
+            self._count('fills_ok')
+            raise FormatTooLarge(response.json().get('error', 'No format fits the budget'))
+        if response.status_code != 200:
+            self._count('fills_failed')
+            logger.warning(f"Cache fill by {owner} returned {response.status_code}")
+            return False
+        self._count('fills_ok')
+        return True
+
+    def filled(self):
+        self._count('fills_served')
+
+    def stats(self):
+        with self.lock:
+            return {
+                'backend': self.backend.name if self.backend else 'local',
+                'peers': len(self.ring.nodes),
+                'self': self.self_url or None,
+                'uploading': len(self.uploads),
+                **self.counters
+            }
+
+if CACHE_PEERS and not CACHE_PEER_TOKEN:
+    # /cache/fill istemci kotasını atlar; token'sız açık bırakılmaz
+    raise ValueError("CACHE_PEER_TOKEN is required when CACHE_PEERS is set")
+shared_cache = SharedCache(make_cache_backend(CACHE_BACKEND), HashRing(CACHE_PEERS), CACHE_SELF,
+                           CACHE_PEER_TOKEN)
+
+class InfoCache:
+    """Kısa ömürlü extract_info sonuç cache'i (format URL'leri zamanla bayatlar)"""
+
+    def __init__(self, ttl, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url, strategy):
+        if self.ttl <= 0:
+            return None
+        key = (url, strategy)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if not entry:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            info = entry[1]
+        # process_ie_result dict'i değiştirir, kopya ver
+        return copy.deepcopy(info)
+
+    def put(self, url, strategy, info):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[(url, strategy)] = (time.time(), info)
+            self.entries.move_to_end((url, strategy))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, url, strategy):
+        with self.lock:
+            self.entries.pop((url, strategy), None)
+
+    def for_url(self, url):
+        """URL'nin süresi dolmamış (strateji, info) kayıtları"""
+        now = time.time()
+        with self.lock:
+            return [(strategy, info) for (key, strategy), (stored, info) in self.entries.items()
+                    if key == url and now - stored <= self.ttl]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+info_cache = InfoCache(INFO_CACHE_TTL)
+
+# Yönlendirme ile çözülen paylaşım linkleri
+SHORT_LINK_HOSTS = {'vm.tiktok.com', 'vt.tiktok.com', 'fb.watch', 't.co'}
+
+# Aynı medyaya işaret eden host'lar tek biçime indirilir
+CANONICAL_HOSTS = {
+    'x.com': 'twitter.com',
+    'www.x.com': 'twitter.com',
+    'mobile.x.com': 'twitter.com',
+    'www.twitter.com': 'twitter.com',
+    'mobile.twitter.com': 'twitter.com',
+    'youtube.com': 'www.youtube.com',
+    'm.youtube.com': 'www.youtube.com',
+    'instagram.com': 'www.instagram.com',
+    'm.instagram.com': 'www.instagram.com',
+    'facebook.com': 'www.facebook.com',
+    'm.facebook.com': 'www.facebook.com',
+    'tiktok.com': 'www.tiktok.com',
+    'm.tiktok.com': 'www.tiktok.com'
+}
+
+# Medyayı değiştirmeyen izleme parametreleri; platforma özgü olanlar ayrı
+TRACKING_PARAMS = {'fbclid', 'gclid', 'igshid', 'igsh', 'mibextid', 'ref', 'ref_src', 'ref_url'}
+PLATFORM_TRACKING_PARAMS = {
+    'youtube': {'si', 'feature', 'pp'},
+    'instagram': {'utm_source', 'utm_medium', 'img_index'},
+    'tiktok': {'_r', '_t', 'is_from_webapp', 'sender_device', 'is_copy_url', 'web_id', 'lang'},
+    'twitter': {'s', 't'},
+    'facebook': {'rdid', 'share_url', 'sfnsn'}
+}
+
+class ShortLinkResolver:
+    """Kısa linkleri bağlantı havuzlu bir session ile çözer, sonucu TTL ile saklar"""
+
+    def __init__(self, ttl, max_entries=4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.rejected = 0
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENTS[-1]
+
+    def _lookup(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry and time.time() - entry[0] <= self.ttl:
+                self.entries.move_to_end(url)
+                self.hits += 1
+                return entry[1]
+            self.entries.pop(url, None)
+            self.misses += 1
+            return None
+
+    def resolve(self, url):
+        """Son yönlendirme hedefini döndür; çözülemezse URL'nin kendisi
+
+        Hata sayfası ya da login/consent yönlendirmesi kısa linki bir gün
+        zehirlemesin: yalnızca 2xx ile biten ve bir extractor'a uyan hedef
+        kullanılır ve saklanır.
+        """
+        target = self._lookup(url)
+        if target:
+            return target
+        try:
+            r = self.session.head(url, allow_redirects=True, timeout=SHORT_LINK_TIMEOUT)
+            if r.status_code in (403, 405):
+                # HEAD'i kabul etmeyen kısaltıcılar: gövdeyi okumadan GET
+                r = self.session.get(url, allow_redirects=True, timeout=SHORT_LINK_TIMEOUT, stream=True)
+                r.close()
+            target = r.url
+        except requests.RequestException as e:
+            with self.lock:
+                self.errors += 1
+            logger.warning(f"Short link resolution failed for {url}: {e}")
+            return url
+        if not 200 <= r.status_code < 300 or match_extractor(target) is None:
+            with self.lock:
+                self.rejected += 1
+            logger.info(f"Short link {url} resolved to unsupported {target} ({r.status_code}), not caching")
+            return url
+        if self.ttl > 0 and target != url:
+            with self.lock:
+                self.entries[url] = (time.time(), target)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return target
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'rejected': self.rejected
+            }
+
+short_links = ShortLinkResolver(SHORT_LINK_TTL)
+
+def _is_tracking(key, drop):
+    return key in drop or key.startswith('utm_')
+
+def _normalize_url(url):
+    """Şema/host'u düzelt, youtu.be'yi aç, izleme parametrelerini ve fragment'ı at"""
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    host = (parts.hostname or '').rstrip('.')
+    auth = parts.netloc.rpartition('@')[0]
+    if parts.port or auth:
+        # Port/kimlik bilgisi taşıyan adresler olduğu gibi kalır
+        netloc = parts.netloc
+    else:
+        netloc = CANONICAL_HOSTS.get(host, host)
+    path = parts.path
+    # Ham sorgu parçaları korunur: imzalı CDN URL'leri yeniden kodlanmamalı
+    params = [p for p in parts.query.split('&') if p]
+    
+    if host == 'youtu.be' and path.strip('/'):
+        # youtu.be/ID -> watch?v=ID, ağ isteği gerekmez
+        netloc = 'www.youtube.com'
+        params.insert(0, urlencode({'v': path.strip('/')}))
+        path = '/watch'
+    
+    drop = TRACKING_PARAMS | PLATFORM_TRACKING_PARAMS.get(detect_platform(netloc), set())
+    params = [p for p in params
+              if not _is_tracking(unquote_plus(p.partition('=')[0]), drop)]
+    return urlunsplit((parts.scheme.lower(), netloc, path, '&'.join(params), ''))
+
+def canonicalize_url(url):
+    """İndirme öncesi tek biçimli URL; kısa linkler (cache'li) yönlendirmeyle çözülür"""
+    try:
+        if url_host(url) in SHORT_LINK_HOSTS:
+            url = short_links.resolve(_normalize_url(url))
+        return _normalize_url(url)
+    except ValueError:
+        # Ayrıştırılamayan URL'ye dokunma, extractor karar versin
+        return url
+
+class _Flight:
+    def __init__(self, key):
+        self.key = key
+        self.created = time.time()
+        self.trace = Trace()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.refs = 0
+        self.finished = False  # SingleFlight.lock altında değişir
+        self.started = None
+        self.progress = {}
+        self.cancelled = threading.Event()
+        self.stream_ready = threading.Event()
+        self.stream_path = None
+        self.stream_title = None
+        self.stream_bytes = 0
+        self.stream_broken = False
+        self.callbacks = []
+        self.callback_lock = threading.Lock()
+
+    def add_done_callback(self, fn):
+        """Uçuş bitince fn() çağır (bitmişse hemen)"""
+        with self.callback_lock:
+            if not self.event.is_set():
+                self.callbacks.append(fn)
+                return
+        fn()
+
+    def _finish(self):
+        with self.callback_lock:
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning(f"Flight callback failed: {e}")
+
+    def update_stream(self, d, title):
+        """Progressive indirmede yazılmakta olan dosyayı okuyuculara aç"""
+        path = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        if self.stream_path is None:
+            if downloaded and path and os.path.exists(path):
+                self.stream_path, self.stream_title = path, title
+                self.stream_ready.set()
+        elif path != self.stream_path or downloaded < self.stream_bytes:
+            # Başka bir strateji baştan başladı, akan veri artık geçersiz
+            self.stream_broken = True
+        self.stream_bytes = downloaded
+
+    def update_progress(self, d):
+        """yt_dlp progress hook'u"""
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        downloaded = d.get('downloaded_bytes') or 0
+        self.progress = {
+            'status': d.get('status'),
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'percent': round(downloaded * 100 / total, 1) if total else None,
+            'speed': d.get('speed'),
+            'eta': d.get('eta')
+        }
+
+class SingleFlight:
+    """Aynı anahtar için eşzamanlı işleri tek çalıştırmada birleştir
+
+    join() ile uçuşa katılan her çağıran işi bitince release() çağırmalı;
+    son okuyucu bıraktığında cleanup(sonuç) çalışır.
+    """
+
+    def __init__(self, cleanup=None):
+        self.cleanup = cleanup
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.shared = 0
+
+    def join(self, key):
+        """Anahtarın uçuşuna katıl, (flight, lider_mi) döndür"""
+        with self.lock:
+            flight = self.flights.get(key)
+            # Son okuyucu bırakıp iptal edilmiş uçuşa katılma, yenisini başlat
+            leader = flight is None or flight.cancelled.is_set()
+            if leader:
+                flight = self.flights[key] = _Flight(key)
+            else:
+                self.shared += 1
+            flight.refs += 1
+        return flight, leader
+
+    def run(self, flight, fn):
+        """Lider olarak fn(flight) çalıştır ve bekleyenleri uyandır"""
+        flight.started = time.time()
+        flight.trace.add('queue', flight.created, flight.started - flight.created)
+        try:
+            if flight.cancelled.is_set():
+                # Kuyruktayken herkes vazgeçti
+                raise DownloadCancelled('Download cancelled before start')
+            flight.result = fn(flight)
+        except BaseException as e:
+            flight.error = e
+        finally:
+            # Temizlik kararı release() ile aynı kilit altında: tam olarak biri temizler
+            with self.lock:
+                self._drop(flight)
+                orphaned = flight.refs == 0
+            flight._finish()
+            if orphaned:
+                self._cleanup(flight)
+
+    def fail(self, flight, error):
+        """Hiç çalıştırılamayan uçuşu hatayla kapat"""
+        flight.error = error
+        with self.lock:
+            self._drop(flight)
+        flight._finish()
+
+    def _drop(self, flight):
+        # Yerine yeni uçuş başlamış olabilir; yalnızca kendisini çıkar
+        flight.finished = True
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def release(self, flight):
+        with self.lock:
+            flight.refs -= 1
+            if flight.refs:
+                return
+            finished = flight.finished
+            if not finished:
+                # Bekleyen kimse kalmadı, indirmeyi iptal et
+                flight.cancelled.set()
+        if finished:
+            self._cleanup(flight)
+
+    def _cleanup(self, flight):
+        if self.cleanup and flight.result is not None:
+            try:
+                self.cleanup(flight.result)
+            except Exception as e:
+                logger.warning(f"Single-flight cleanup failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.flights),
+                'waiters': sum(f.refs for f in self.flights.values()),
+                'coalesced': self.shared
+            }
+
+def _cleanup_download(result):
+    temp_dir = result[2]
+    if temp_dir:
+        scratch.release(temp_dir)
+
+download_flights = SingleFlight(cleanup=_cleanup_download)
+
+class DownloadJob:
+    """Tek bir istemcinin indirme işi; sonucu paylaşılan flight'tan okur"""
+
+    def __init__(self, url, quality, key, budget=None):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.quality = quality
+        self.budget = budget
+        self.key = key
+        self.created = time.time()
+        self.flight = None
+        self.cached = None
+        self.pool = None
+        self.lock = threading.Lock()
+        self.released = False
+
+    @property
+    def done(self):
+        return self.cached is not None or self.flight.event.is_set()
+
+    @property
+    def status(self):
+        if self.cached is not None:
+            return 'finished'
+        if self.flight.event.is_set():
+            return 'failed' if self.flight.error else 'finished'
+        return 'running' if self.flight.started else 'queued'
+
+    def wait(self, timeout=None):
+        """Bitmesini bekle, (dosya yolu, başlık) döndür"""
+        if self.cached is not None:
+            return self.cached
+        if not self.flight.event.wait(timeout):
+            raise TimeoutError(f"Download timeout after {timeout} seconds")
+        if self.flight.error:
+            raise self.flight.error
+        file_path, title, _ = self.flight.result
+        return file_path, title
+
+    def wait_stream(self, timeout):
+        """Dosya bitene ya da pass-through akış başlayana kadar bekle
+
+        (dosya yolu, başlık, akış_mı) döndürür; akış modunda ilk eleman
+        yol değil, hâlâ yazılan .part dosyasının açık nesnesidir. Dosya
+        burada açılır: yt_dlp bitince .part'ı yeniden adlandırır, açık
+        descriptor bundan etkilenmez.
+        """
+        if self.cached is not None:
+            return self.cached[0], self.cached[1], False
+        flight = self.flight
+        deadline = time.time() + timeout
+        while not flight.event.is_set():
+            if flight.stream_ready.is_set() and not flight.stream_broken:
+                try:
+                    return open(flight.stream_path, 'rb'), flight.stream_title, True
+                except FileNotFoundError:
+                    # Yeniden adlandırıldı; indirme bitmek üzere, bitmiş dosya gönderilir
+                    pass
+            if time.time() > deadline:
+                raise TimeoutError(f"Download timeout after {timeout} seconds")
+            flight.event.wait(0.05)
+        file_path, title = self.wait(0)
+        return file_path, title, False
+
+    def release(self):
+        """Paylaşılan sonuca olan referansı bırak (idempotent)"""
+        with self.lock:
+            if self.released or self.flight is None:
+                self.released = True
+                return
+            self.released = True
+        download_flights.release(self.flight)
+
+    def to_dict(self):
+        status = self.status
+        data = {
+            'job_id': self.id,
+            'url': self.url,
+            'status': status,
+            'created': self.created,
+            'cache_hit': self.cached is not None
+        }
+        if self.flight is not None:
+            data['progress'] = self.flight.progress
+        if status == 'queued' and self.pool is not None:
+            data['queue_position'] = self.pool.position(self.flight)
+        elif status == 'running':
+            position = download_gate.position(self.flight)
+            if position is not None:
+                # Extraction bitti, indirme kapısında sıra bekliyor
+                data['stage'] = 'waiting_for_download'
+                data['queue_position'] = position
+        if status == 'failed':
+            if isinstance(self.flight.error, TimeoutError):
+                data['error'] = 'Download timeout'
+            elif isinstance(self.flight.error, PoolSaturated):
+                data['error'] = 'Server busy'
+            elif isinstance(self.flight.error, FormatTooLarge):
+                data['error'] = str(self.flight.error)
+            else:
+                data['error'] = 'Video indirilemedi'
+            if app.debug:
+                data['details'] = str(self.flight.error)
+        return data
+
+class ClientQuota:
+    """İstemci kimliği ve kotası (API anahtarı ya da IP)"""
+
+    def __init__(self, id, rate=CLIENT_RATE, burst=CLIENT_BURST, weight=1.0):
+        self.id = id
+        self.rate = float(rate)
+        self.burst = int(burst)
+        self.weight = float(weight)
+
+    @classmethod
+    def resolve(cls, api_key, remote_addr, forwarded_for=None):
+        # Tanınmayan anahtar IP kimliğine düşer; rastgele anahtarlarla yeni kova açılamaz
+        if api_key and api_key in API_KEYS:
+            limits = API_KEYS[api_key]
+            # Loglarda/stats'ta anahtarın kendisi görünmesin
+            digest = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+            return cls(f'key:{digest}', limits.get('rate', CLIENT_RATE),
+                       limits.get('burst', CLIENT_BURST), limits.get('weight', 1.0))
+        ip = remote_addr
+        hops = [h.strip() for h in (forwarded_for or '').split(',') if h.strip()]
+        if hops and TRUSTED_PROXY_HOPS:
+            # Sağdan sayılır; istemcinin kendi yazdığı sol kısım dikkate alınmaz
+            ip = hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+        return cls(f'ip:{ip or "unknown"}')
+
+class RateLimiter:
+    """İstemci başına token bucket; en uzun süre kullanılmayan kovalar atılır"""
+
+    def __init__(self, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # istemci -> (token, son güncelleme)
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, client, cost=1):
+        """cost token harca; yetmiyorsa RateLimited fırlat"""
+        if client.rate <= 0:
+            return
+        # Kovadan büyük istek hiç geçemezdi
+        cost = min(cost, client.burst)
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.pop(client.id, (client.burst, now))
+            tokens = min(client.burst, tokens + (now - updated) * client.rate)
+            if tokens < cost:
+                self.buckets[client.id] = (tokens, now)
+                self.limited += 1
+                raise RateLimited(max(1, int((cost - tokens) / client.rate + 0.999)))
+            self.buckets[client.id] = (tokens - cost, now)
+            self.allowed += 1
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'rate': CLIENT_RATE,
+                'burst': CLIENT_BURST,
+                'api_keys': len(API_KEYS),
+                'clients': len(self.buckets),
+                'allowed': self.allowed,
+                'limited': self.limited
+            }
+
+rate_limiter = RateLimiter()
+
+class DownloadPool:
+    """Sabit sayıda worker thread ve derinliği sınırlı, istemciler arası adil kuyruk
+
+    Kuyruk start-time fair queueing ile sıralanır: istemcinin her işi
+    max(sanal zaman, önceki işinin bitişi) + 1/ağırlık etiketini alır ve en
+    küçük etiket önce çalışır. Böylece çok iş atan bir istemci diğerlerinin
+    önüne geçemez; ağırlığı yüksek anahtarlar orantılı olarak daha çok pay alır.
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.cond = threading.Condition()
+        self.queue = []  # heap: (bitiş etiketi, sıra, başlangıç etiketi, istemci, fn, args)
+        self.seq = count()
+        self.virtual_time = 0.0
+        self.finish = {}  # istemci -> son işinin bitiş etiketi
+        self.queued = {}  # istemci -> kuyruktaki iş sayısı
+        self.active = 0
+        self.rejected = 0
+        self.avg_duration = float(DOWNLOAD_TIMEOUT) / 4
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'download-{i}', daemon=True).start()
+
+    def submit(self, fn, *args, client=None, weight=1.0):
+        """İşi kuyruğa al; kuyruk doluysa PoolSaturated fırlat"""
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(self._retry_after())
+            start = max(self.virtual_time, self.finish.get(client, 0.0))
+            finish = start + 1.0 / max(weight, 0.01)
+            self.finish[client] = finish
+            self.queued[client] = self.queued.get(client, 0) + 1
+            heapq.heappush(self.queue, (finish, next(self.seq), start, client, fn, args))
+            self.cond.notify()
+
+    def call(self, fn, *args, client=None, weight=1.0):
+        """fn(*args)'ı aynı kuyruk ve kabul kontrolüyle çalıştır, sonucu Future ile döndür"""
+        future = Future()
+        self.submit(self._resolve, future, fn, args, client=client, weight=weight)
+        return future
+
+    @staticmethod
+    def _resolve(future, fn, args):
+        # Bekleyen vazgeçtiyse (cancel) hiç çalıştırma
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def position(self, item):
+        """item'ı argüman olarak taşıyan işin kuyruktaki sırası (1'den), yoksa None"""
+        with self.cond:
+            for index, entry in enumerate(sorted(self.queue, key=lambda e: e[:2])):
+                if any(arg is item for arg in entry[5]):
+                    return index + 1
+        return None
+
+    def _retry_after(self):
+        # Kuyruğun boşalması için kabaca beklenen süre
+        waves = (len(self.queue) + self.active) / max(self.workers, 1)
+        return max(1, int(waves * self.avg_duration))
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                _, _, start, client, fn, args = heapq.heappop(self.queue)
+                self.virtual_time = max(self.virtual_time, start)
+                self.queued[client] -= 1
+                if not self.queued[client]:
+                    # Boştaki istemcinin geçmişi tutulmaz, dönünce sanal zamandan başlar
+                    del self.queued[client]
+                    del self.finish[client]
+                self.active += 1
+            started = time.time()
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Download worker error: {e}")
+            finally:
+                with self.cond:
+                    self.active -= 1
+                    self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.time() - started)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'workers': self.workers,
+                'active': self.active,
+                'queued': len(self.queue),
+                'queued_clients': len(self.queued),
+                'max_queue': self.max_queue,
+                'rejected': self.rejected
+            }
+
+class DownloadGate:
+    """İndirme fazı için yaşlanmalı kısa-iş-önce (SJF) kapısı
+
+    Extraction'ı biten iş, info'dan tahmin edilen süresiyle bekler; boş slot
+    açılınca (tahmini süre - SJF_AGING x bekleme) değeri en küçük olan girer.
+    ASGI modunda her alt process tek indirme yaptığından kapıda sıra oluşmaz.
+    """
+
+    def __init__(self, slots, aging):
+        self.slots = slots
+        self.aging = aging
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = {}  # bilet -> (tahmini sn, giriş zamanı)
+        self.admitted = 0
+        self.overtaken = 0  # kendisinden önce gelen birini geçerek girenler
+
+    @staticmethod
+    def estimate(info, selected=None):
+        """İndirme süresi tahmini (sn): boyut/varsayılan hız, yoksa video süresi"""
+        duration = info.get('duration')
+        size = FormatBudget.estimate_size(selected or info, duration)
+        if size:
+            return size / SJF_ASSUMED_BPS
+        if duration:
+            # Boyut yoksa indirme süresi kabaca video süresiyle orantılı
+            return duration / 10.0
+        return SJF_DEFAULT_COST
+
+    def _ordered(self, now):
+        def priority(ticket):
+            cost, since = self.waiting[ticket]
+            return cost - self.aging * (now - since), since
+        return sorted(self.waiting, key=priority)
+
+    def acquire(self, ticket, cost, check=None):
+        """Sıra gelene kadar bekle; check() iptal/zaman aşımında hata fırlatır"""
+        with self.cond:
+            self.waiting[ticket] = (cost, time.time())
+            try:
+                while self.active >= self.slots or self._ordered(time.time())[0] is not ticket:
+                    if check:
+                        check()
+                    self.cond.wait(0.5)
+                since = self.waiting[ticket][1]
+                if any(other < since for _, other in self.waiting.values()):
+                    self.overtaken += 1
+            finally:
+                del self.waiting[ticket]
+                # Sıra değişti; bekleyenler yeniden baksın
+                self.cond.notify_all()
+            self.active += 1
+            self.admitted += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def position(self, ticket):
+        """Kapıdaki sıra (1'den), beklemiyorsa None"""
+        with self.cond:
+            if ticket not in self.waiting:
+                return None
+            return self._ordered(time.time()).index(ticket) + 1
+
+    def stats(self):
+        with self.cond:
+            return {
+                'slots': self.slots,
+                'active': self.active,
+                'waiting': len(self.waiting),
+                'admitted': self.admitted,
+                'overtaken': self.overtaken,
+                'aging': self.aging
+            }
+
+download_gate = DownloadGate(DOWNLOAD_SLOTS, SJF_AGING)
+
+def download_in_thread(url, quality, flight, budget=None):
+    """İndirmeyi çağıran worker thread'inde çalıştır"""
+    downloader = SimpleDownloader(progress_hook=flight.update_progress,
+                                  cancel_event=flight.cancelled,
+                                  stream_hook=flight.update_stream,
+                                  trace=flight.trace,
+                                  budget=budget,
+                                  ticket=flight)
+    return downloader.download_with_timeout(url, quality)
+
+class JobManager:
+    """Sınırlı worker havuzu ve süreli iş tablosu"""
+
+    def __init__(self, pool, ttl, download=download_in_thread):
+        self.pool = pool
+        self.ttl = ttl
+        self.download = download
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, url, quality, budget=None, client=None, local_only=False):
+        self._expire()
+        key = video_cache_key(url, quality, budget)
+        job = DownloadJob(url, quality, key, budget)
+        job.pool = self.pool
+        job.cached = result_cache.get(key)
+        if job.cached is None:
+            job.flight, leader = download_flights.join(key)
+            if leader:
+                try:
+                    # Disk doluysa kuyruğa hiç alma
+                    scratch.admit()
+                    self.pool.submit(download_flights.run, job.flight,
+                                     lambda flight: self._fetch(url, quality, key, flight, budget, local_only),
+                                     client=client and client.id,
+                                     weight=client.weight if client else 1.0)
+                except PoolSaturated as e:
+                    download_flights.fail(job.flight, e)
+                    job.release()
+                    raise
+        with self.lock:
+            self.jobs[job.id] = job
+        return job
+
+    def _fetch(self, url, quality, key, flight, budget=None, local_only=False):
+        if shared_cache.enabled:
+            loaded = self._fetch_shared(url, quality, key, flight, budget, local_only)
+            if loaded:
+                return loaded
+        with DOWNLOADS_IN_FLIGHT.track_inprogress():
+            file_path, title = self.download(url, quality, flight, budget)
+        temp_dir = os.path.dirname(file_path)
+        with flight.trace.span('cache_store'):
+            cached_path = result_cache.put(key, file_path, title)
+        if shared_cache.enabled:
+            shared_cache.store_async(key, cached_path or file_path, title)
+        if cached_path:
+            # Dosya cache'e taşındı, temp klasöre gerek kalmadı
+            scratch.release(temp_dir)
+            return cached_path, title, None
+        return file_path, title, temp_dir
+
+    def _fetch_shared(self, url, quality, key, flight, budget, local_only):
+        """Paylaşımlı cache'ten ya da anahtarın sahibi replika üzerinden getir"""
+        with flight.trace.span('shared_cache'):
+            loaded = shared_cache.load(key)
+        if loaded or local_only:
+            return loaded
+        owner = shared_cache.owner(key)
+        if owner is None:
+            return None
+        with flight.trace.span('peer_fill'):
+            filled = shared_cache.request_fill(owner, url, quality, budget)
+        if not filled:
+            # Sahip ulaşılamıyor; yerelde indir
+            return None
+        with flight.trace.span('shared_cache'):
+            return shared_cache.load(key)
+
+    def get(self, job_id):
+        self._expire()
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def discard(self, job):
+        with self.lock:
+            self.jobs.pop(job.id, None)
+        job.release()
+
+    def discard_when_done(self, job):
+        """Uçuş bitince bırak; beklemeyi bırakan istek süren indirmeyi iptal ettirmesin"""
+        if job.flight is None:
+            self.discard(job)
+        else:
+            job.flight.add_done_callback(lambda: self.discard(job))
+
+    def _expire(self):
+        now = time.time()
+        with self.lock:
+            expired = [j for j in self.jobs.values() if j.done and now - j.created > self.ttl]
+            for job in expired:
+                self.jobs.pop(job.id, None)
+        for job in expired:
+            job.release()
+
+    def stats(self):
+        with self.lock:
+            statuses = [j.status for j in self.jobs.values()]
+        return {
+            'jobs': len(statuses),
+            'queued': statuses.count('queued'),
+            'running': statuses.count('running'),
+            'pool': self.pool.stats()
+        }
+
+class YDLLogger:
+    """yt_dlp çıktısını log kuyruğuna yönlendirir
+
+    yt_dlp hataları strateji satırında zaten loglandığı için DEBUG'a iner;
+    uyarılar tekrarlı olduğundan seyreltilir.
+    """
+
+    def __init__(self, name):
+        self.log = logging.getLogger(name)
+
+    def debug(self, msg):
+        self.log.debug(msg)
+
+    def info(self, msg):
+        self.log.info(msg)
+
+    def warning(self, msg):
+        self.log.warning(msg, extra={'sample_key': 'yt_dlp'})
+
+    def error(self, msg):
+        self.log.debug(msg)
+
+ydl_logger = YDLLogger(f'{__name__}.yt_dlp')
+
+class YDLPool:
+    """Seçenek profiline göre ısınmış YoutubeDL instance'ları
+
+    Extractor instance'ları, cookie jar ve HTTP bağlantı havuzu istekler
+    arasında korunur. outtmpl, format, header ve progress hook'ları her
+    kiralamada yeniden ayarlanır.
+    """
+
+    # Profil anahtarına girmeyen, kiralama başına değişen seçenekler
+    OVERRIDES = ('outtmpl', 'format', 'http_headers', 'progress_hooks')
+
+    def __init__(self, max_idle, idle_ttl):
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self.lock = threading.Lock()
+        self.idle = OrderedDict()  # (profil, id) -> (son kullanım, ydl)
+        self.created = 0
+        self.reused = 0
+
+    @classmethod
+    def profile_key(cls, opts):
+        profile = {k: v for k, v in opts.items() if k not in cls.OVERRIDES}
+        return json.dumps(profile, sort_keys=True, default=str)
+
+    def _take(self, key):
+        now = time.time()
+        with self.lock:
+            stale = [k for k, (used, _) in self.idle.items() if now - used > self.idle_ttl]
+            stale_ydls = [self.idle.pop(k)[1] for k in stale]
+            ydl = None
+            for k in reversed(self.idle):
+                if k[0] == key:
+                    ydl = self.idle.pop(k)[1]
+                    self.reused += 1
+                    break
+        for old in stale_ydls:
+            self._close(old)
+        return ydl
+
+    def _give_back(self, key, ydl):
+        with self.lock:
+            self.idle[(key, id(ydl))] = (time.time(), ydl)
+            evicted = []
+            while len(self.idle) > self.max_idle:
+                evicted.append(self.idle.popitem(last=False)[1][1])
+        for old in evicted:
+            self._close(old)
+
+    @staticmethod
+    def _close(ydl):
+        try:
+            ydl.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _params(opts):
+        # YoutubeDL params dict'ini değiştirir; hook'lar (bound method) kopyalanmaz
+        params = copy.deepcopy({k: v for k, v in opts.items() if k != 'progress_hooks'})
+        params['progress_hooks'] = list(opts.get('progress_hooks', []))
+        # Konsol progress satırları yok, yt_dlp mesajları log kuyruğundan geçer
+        params.setdefault('noprogress', True)
+        params['logger'] = ydl_logger
+        return params
+
+    @staticmethod
+    def set_format(ydl, fmt):
+        """Format'ı değiştir; yt_dlp seçiciyi __init__'te bir kez kurduğu için yeniden kurulur"""
+        if fmt == ydl.params.get('format'):
+            return
+        ydl.params['format'] = fmt
+        ydl.format_selector = (fmt if fmt in (None, '-') or callable(fmt)
+                               else ydl.build_format_selector(fmt))
+
+    @contextlib.contextmanager
+    def lease(self, opts):
+        """opts için bir YoutubeDL kirala; with bloğu bitince havuza döner"""
+        if self.max_idle <= 0:
+            with yt_dlp.YoutubeDL(self._params(opts)) as ydl:
+                yield ydl
+            return
+        
+        key = self.profile_key(opts)
+        ydl = self._take(key)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(self._params(opts))
+            with self.lock:
+                self.created += 1
+        else:
+            # Kiralamaya özel seçenekler
+            ydl.params['outtmpl']['default'] = opts['outtmpl']['default']
+            self.set_format(ydl, opts.get('format'))
+            ydl.params['http_headers'] = HTTPHeaderDict(std_headers, opts.get('http_headers'))
+            ydl._progress_hooks = list(opts.get('progress_hooks', []))
+        try:
+            yield ydl
+        finally:
+            # Eski isteğin hook'ları (ve downloader'ı) havuzda tutulmasın
+            ydl._progress_hooks = []
+            self._give_back(key, ydl)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'idle': len(self.idle),
+                'max_idle': self.max_idle,
+                'created': self.created,
+                'reused': self.reused
+            }
+
+ydl_pool = YDLPool(YDL_POOL_SIZE, YDL_POOL_IDLE_TTL)
+
+class HedgeLimiter:
+    """Platform başına aynı anda çalışan ek (hedge) extraction sayısını sınırlar
+
+    Her isteğin ilk denemesi sayılmaz; yalnızca yarışa eklenen fazladan
+    extraction'lar bir slot tutar. Slot yoksa sıradaki strateji bir önceki
+    bitene kadar bekler, yani o istek sıralı moda düşer.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.active = {}
+        self.started = 0
+        self.throttled = 0
+        self.races = 0
+        self.wins = {}  # kazananın yarıştaki sırası -> adet
+
+    def try_acquire(self, platform):
+        with self.lock:
+            if self.active.get(platform, 0) >= self.limit:
+                self.throttled += 1
+                return False
+            self.active[platform] = self.active.get(platform, 0) + 1
+            self.started += 1
+            return True
+
+    def release(self, platform):
+        with self.lock:
+            self.active[platform] -= 1
+            if not self.active[platform]:
+                del self.active[platform]
+
+    def record(self, position):
+        with self.lock:
+            self.races += 1
+            if position is not None:
+                self.wins[position] = self.wins.get(position, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'enabled': HEDGE_STRATEGIES,
+                'width': HEDGE_WIDTH,
+                'delay': HEDGE_DELAY,
+                'platform_limit': self.limit,
+                'active': dict(self.active),
+                'hedges_started': self.started,
+                'hedges_throttled': self.throttled,
+                'races': self.races,
+                'wins_by_position': {str(k): v for k, v in sorted(self.wins.items())}
+            }
+
+hedge_limiter = HedgeLimiter(HEDGE_PLATFORM_LIMIT)
+
+class BandwidthGovernor:
+    """Global bant genişliği bütçesi; aktif indirmeler arasında eşit bölünür
+
+    Kısıtlama progress hook'unda yapılır: payından hızlı giden indirme
+    aradaki fark kadar uyur, böylece büyük bir video diğerlerini aç bırakmaz.
+    limit 0 ise yalnızca throughput ölçülür.
+    """
+
+    WINDOW = 5.0  # throughput penceresi (sn)
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.active = 0
+        self.samples = deque()  # (zaman, bayt)
+        self.bytes_total = 0
+        self.throttled_seconds = 0.0
+
+    @contextlib.contextmanager
+    def track(self):
+        """Bir indirme süresince pay al; slot.update() progress hook'undan çağrılır"""
+        with self.lock:
+            self.active += 1
+        try:
+            yield _BandwidthSlot(self)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def share(self):
+        with self.lock:
+            return self.limit / max(self.active, 1) if self.limit else 0
+
+    def record(self, nbytes, now, slept=0.0):
+        with self.lock:
+            self.bytes_total += nbytes
+            self.throttled_seconds += slept
+            if nbytes:
+                self.samples.append((now, nbytes))
+            self._trim(now)
+
+    def _trim(self, now):
+        while self.samples and now - self.samples[0][0] > self.WINDOW:
+            self.samples.popleft()
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            self._trim(now)
+            recent = sum(n for _, n in self.samples)
+            return {
+                'limit_bps': self.limit or None,
+                'active_downloads': self.active,
+                'fair_share_bps': int(self.limit / max(self.active, 1)) if self.limit else None,
+                'throughput_bps': int(recent / self.WINDOW),
+                'bytes_total': self.bytes_total,
+                'throttled_seconds': round(self.throttled_seconds, 2),
+                'fragment_concurrency': FRAGMENT_CONCURRENCY
+            }
+
+class _BandwidthSlot:
+    """Tek indirmenin payı; fragment thread'leri aynı anda çağırabilir"""
+
+    def __init__(self, governor):
+        self.governor = governor
+        self.lock = threading.Lock()
+        self.last_bytes = 0
+        self.last_time = time.time()
+        self.due = self.last_time  # şimdiye kadarki baytların paya göre bitmesi gereken an
+
+    def update(self, downloaded):
+        now = time.time()
+        share = self.governor.share()
+        with self.lock:
+            delta = downloaded - self.last_bytes
+            if delta < 0:
+                # Yeni dosya (ör. video + ses ayrı formatlar)
+                delta = downloaded
+            self.last_bytes = downloaded
+            wait = 0.0
+            if share and delta:
+                self.due = max(self.due, self.last_time) + delta / share
+                wait = min(self.due - now, BANDWIDTH_MAX_SLEEP)
+            self.last_time = now
+        wait = max(wait, 0.0)
+        self.governor.record(delta, now, wait)
+        if wait:
+            time.sleep(wait)
+
+bandwidth = BandwidthGovernor(BANDWIDTH_LIMIT)
+
 class SimpleDownloader:
-    def __init__(self):
+    # Platform -> indirme yöntemi
+    HANDLERS = {
+        'youtube': '_youtube_download',
+        'instagram': '_instagram_download',
+        'facebook': '_facebook_download',
+        'tiktok': '_tiktok_download',
+        'twitter': '_twitter_download'
+    }
+
+    def __init__(self, progress_hook=None, cancel_event=None, stream_hook=None, trace=None,
+                 budget=None, ticket=None):
         self.logger = logger
-        self.result = None
-        self.error = None
+        self.trace = trace
+        self.budget = budget
+        self.ticket = ticket or self  # indirme kapısındaki sıra için (job status)
+        self.progress_hook = progress_hook
+        self.cancel_event = cancel_event
+        self.stream_hook = stream_hook
+        self.streamable = False
+        self.title = None
+        self.deadline = None
+        self.platform = 'generic'  # metrik etiketi
+        self.extract_only = False
+        self.bandwidth_slot = None
 
     def download_with_timeout(self, url, quality, timeout=DOWNLOAD_TIMEOUT):
-        def download_worker():
-            try:
-                self.result = self._download(url, quality)
-            except Exception as e:
-                self.error = e
+        """İndirmeyi çağıran (havuz) thread'inde süre sınırıyla çalıştır
 
-        thread = threading.Thread(target=download_worker)
-        thread.daemon = True
-        thread.start()
-        thread.join(timeout)
-        
-        if thread.is_alive():
-            raise TimeoutError(f"Download timeout after {timeout} seconds")
-        
-        if self.error:
-            raise self.error
-            
-        return self.result
+        Süre dolunca ya da iptal edilince progress hook indirmeyi keser,
+        sıradaki strateji de başlamadan durur.
+        """
+        self.deadline = time.time() + timeout
+        try:
+            return self._download(url, quality)
+        except Exception:
+            if time.time() > self.deadline:
+                raise TimeoutError(f"Download timeout after {timeout} seconds")
+            raise
+
+    def extract_with_timeout(self, url, timeout=INFO_TIMEOUT):
+        """İndirmeden yalnızca extraction; (strateji, sanitize edilmiş info) döndür
+
+        Aynı platform stratejileri çalışır, sonuç info cache'e yazıldığı için
+        ardından gelen /download aynı stratejide extraction'ı atlar.
+        """
+        self.extract_only = True
+        return self.download_with_timeout(url, None, timeout)
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise DownloadCancelled('Download cancelled')
+        if self.deadline and time.time() > self.deadline:
+            raise DownloadCancelled('Download deadline exceeded')
+
+    def _span(self, name, desc=None):
+        if self.trace is None:
+            return contextlib.nullcontext()
+        return self.trace.span(name, desc)
+
+    @contextlib.contextmanager
+    def _timed(self, histogram, phase, strategy):
+        """Fazı hem metrik histogramına hem trace'e yaz"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            histogram.labels(self.platform, strategy).observe(elapsed)
+            if self.trace is not None:
+                self.trace.add(phase, start, elapsed, strategy)
+
+    def _progress(self, d):
+        """yt_dlp progress hook; iptal/zaman aşımında indirmeyi durdurur"""
+        self._check_cancelled()
+        if self.bandwidth_slot is not None and d.get('status') == 'downloading':
+            self.bandwidth_slot.update(d.get('downloaded_bytes') or 0)
+        if self.progress_hook:
+            self.progress_hook(d)
+        if self.stream_hook and self.streamable and d.get('status') == 'downloading':
+            self.stream_hook(d, self.title)
 
     def _download(self, url, quality):
-        temp_dir = tempfile.mkdtemp()
-        
-        try:
-            # Platform tespiti
-            if 'youtube' in url.lower() or 'youtu.be' in url.lower():
-                return self._youtube_download(url, quality, temp_dir)
-            elif 'instagram.com' in url.lower():
-                return self._instagram_download(url, quality, temp_dir)
-            elif 'facebook.com' in url.lower() or 'fb.watch' in url.lower():
-                return self._facebook_download(url, quality, temp_dir)
-            elif 'tiktok.com' in url.lower() or 'vm.tiktok.com' in url.lower() or 'vt.tiktok.com' in url.lower():
-                return self._tiktok_download(url, quality, temp_dir)
-            elif 'twitter.com' in url.lower() or 'x.com' in url.lower() or 't.co' in url.lower():
-                self.logger.info(f"Twitter/X platform detected: {url}")
-                return self._twitter_download(url, quality, temp_dir)
+        temp_dir = scratch.create()
+        
+        try:
+            # Platform tespiti: host sonek tablosu, bilinmeyenlerde extractor eşleşmesi
+            with self._span('detect'):
+                platform, ie_key = route_url(url)
+            if platform == 'generic':
+                self.logger.info(f"Unknown platform, using {ie_key} extractor")
+                result = self._generic_download(url, quality, temp_dir, ie_key)
             else:
-                # Bilinmeyen platform için sırayla dene
-                self.logger.info("Unknown platform, trying multiple extractors...")
-                
-                # Önce TikTok dene (kısa linkler olabilir)
-                try:
-                    self.logger.info("Unknown URL - Trying TikTok extractor...")
-                    return self._tiktok_download(url, quality, temp_dir)
-                except Exception as tiktok_error:
-                    self.logger.warning(f"TikTok failed: {tiktok_error}")
-                
-                # Sonra Twitter dene (X.com olabilir)
-                try:
-                    self.logger.info("Unknown URL - Trying Twitter/X extractor...")
-                    return self._twitter_download(url, quality, temp_dir)
-                except Exception as twitter_error:
-                    self.logger.warning(f"Twitter failed: {twitter_error}")
-                
-                # Son olarak generic
-                self.logger.info("Unknown URL - Trying generic extractor...")
-                return self._generic_download(url, quality, temp_dir)
+                self.logger.info(f"Platform detected: {platform}")
+                result = getattr(self, self.HANDLERS[platform])(url, quality, temp_dir)
+            if self.extract_only:
+                return result
+            # Cache'e girmeden önce: doğru uzantı ve fast-start MP4
+            with self._span('postprocess'):
+                file_path = postprocess_media(result[0])
+            return file_path, result[1]
         except Exception as e:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            scratch.release(temp_dir)
             raise e
+        finally:
+            if self.extract_only:
+                scratch.release(temp_dir)
 
     def _youtube_download(self, url, quality, temp_dir):
         strategies = [
@@ -302,10 +2724,8 @@ class SimpleDownloader:
             }
         ]
         
-        for strategy in strategies:
-            try:
-                self.logger.info(f"YouTube strategy: {strategy['name']}")
-                
+        def attempts():
+            for strategy in strategies:
                 # Base headers
                 base_headers = {
                     'User-Agent': strategy['agent'],
@@ -359,28 +2779,9 @@ class SimpleDownloader:
                         'outtmpl': {'default': os.path.join(temp_dir, '%(title)s.%(ext)s')}
                     }
                 
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    if not info:
-                        continue
-                        
-                    title = clean_filename(info.get('title', 'video'))
-                    opts['outtmpl']['default'] = os.path.join(temp_dir, f'{title}.%(ext)s')
-                    
-                    ydl.download([url])
-                    
-                    files = os.listdir(temp_dir)
-                    if files:
-                        file_path = os.path.join(temp_dir, files[0])
-                        if os.path.getsize(file_path) > 1024:
-                            return file_path, title
-                            
-            except Exception as e:
-                self.logger.warning(f"Strategy {strategy['name']} failed: {str(e)}")
-                self.logger.debug(f"Strategy {strategy['name']} full error: {type(e).__name__}: {e}")
-                continue
-                
-        raise Exception("All YouTube strategies failed")
+                yield strategy['name'], opts, url
+        
+        return self._run_strategies('YouTube', attempts(), temp_dir, 'video')
 
     def _instagram_download(self, url, quality, temp_dir):
         """Instagram video indirme"""
@@ -399,10 +2800,8 @@ class SimpleDownloader:
             }
         ]
         
-        for strategy in strategies:
-            try:
-                self.logger.info(f"Instagram strategy: {strategy['name']}")
-                
+        def attempts():
+            for strategy in strategies:
                 opts = {
                     'format': strategy['quality'],
                     'quiet': True,
@@ -421,27 +2820,9 @@ class SimpleDownloader:
                     'no_check_certificate': True
                 }
                 
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    if not info:
-                        continue
-                        
-                    title = clean_filename(info.get('title', 'instagram_video'))
-                    opts['outtmpl']['default'] = os.path.join(temp_dir, f'{title}.%(ext)s')
-                    
-                    ydl.download([url])
-                    
-                    files = os.listdir(temp_dir)
-                    if files:
-                        file_path = os.path.join(temp_dir, files[0])
-                        if os.path.getsize(file_path) > 1024:
-                            return file_path, title
-                            
-            except Exception as e:
-                self.logger.warning(f"Instagram strategy {strategy['name']} failed: {e}")
-                continue
-                
-        raise Exception("All Instagram strategies failed")
+                yield strategy['name'], opts, url
+        
+        return self._run_strategies('Instagram', attempts(), temp_dir, 'instagram_video')
 
     def _facebook_download(self, url, quality, temp_dir):
         """Facebook video indirme"""
@@ -465,10 +2846,8 @@ class SimpleDownloader:
             }
         ]
         
-        for strategy in strategies:
-            try:
-                self.logger.info(f"Facebook strategy: {strategy['name']}")
-                
+        def attempts():
+            for strategy in strategies:
                 opts = {
                     'format': strategy['quality'],
                     'quiet': True,
@@ -488,27 +2867,9 @@ class SimpleDownloader:
                     'ignore_errors': True
                 }
                 
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    if not info:
-                        continue
-                        
-                    title = clean_filename(info.get('title', 'facebook_video'))
-                    opts['outtmpl']['default'] = os.path.join(temp_dir, f'{title}.%(ext)s')
-                    
-                    ydl.download([url])
-                    
-                    files = os.listdir(temp_dir)
-                    if files:
-                        file_path = os.path.join(temp_dir, files[0])
-                        if os.path.getsize(file_path) > 1024:
-                            return file_path, title
-                            
-            except Exception as e:
-                self.logger.warning(f"Facebook strategy {strategy['name']} failed: {e}")
-                continue
-                
-        raise Exception("All Facebook strategies failed")
+                yield strategy['name'], opts, url
+        
+        return self._run_strategies('Facebook', attempts(), temp_dir, 'facebook_video')
 
     def _tiktok_download(self, url, quality, temp_dir):
         """TikTok video indirme - gelişmiş"""
@@ -541,10 +2902,8 @@ class SimpleDownloader:
             }
         ]
         
-        for strategy in strategies:
-            try:
-                self.logger.info(f"TikTok strategy: {strategy['name']}")
-                
+        def attempts():
+            for strategy in strategies:
                 opts = {
                     'format': strategy['quality'],
                     'quiet': True,
@@ -569,29 +2928,9 @@ class SimpleDownloader:
                 # Ekstra seçenekleri birleştir
                 opts.update(strategy['extra_opts'])
                 
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    if not info:
-                        self.logger.warning(f"No info extracted for {strategy['name']}")
-                        continue
-                        
-                    title = clean_filename(info.get('title', 'tiktok_video'))
-                    opts['outtmpl']['default'] = os.path.join(temp_dir, f'{title}.%(ext)s')
-                    
-                    ydl.download([url])
-                    
-                    files = os.listdir(temp_dir)
-                    if files:
-                        file_path = os.path.join(temp_dir, files[0])
-                        if os.path.getsize(file_path) > 1024:
-                            self.logger.info(f"TikTok download successful: {file_path}")
-                            return file_path, title
-                            
-            except Exception as e:
-                self.logger.warning(f"TikTok strategy {strategy['name']} failed: {e}")
-                continue
-                
-        raise Exception("All TikTok strategies failed")
+                yield strategy['name'], opts, url
+        
+        return self._run_strategies('TikTok', attempts(), temp_dir, 'tiktok_video')
 
     def _twitter_download(self, url, quality, temp_dir):
         """Twitter/X video indirme - gelişmiş ve güçlendirilmiş"""
@@ -663,10 +3002,8 @@ class SimpleDownloader:
             }
         ]
         
-        for strategy in strategies:
-            try:
-                self.logger.info(f"Twitter strategy: {strategy['name']} with URL: {strategy['url']}")
-                
+        def attempts():
+            for strategy in strategies:
                 opts = {
                     'format': strategy['quality'],
                     'quiet': True,
@@ -694,41 +3031,14 @@ class SimpleDownloader:
                 # Ekstra seçenekleri birleştir
                 opts.update(strategy['extra_opts'])
                 
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    # Önce info extraction
-                    info = ydl.extract_info(strategy['url'], download=False)
-                    if not info:
-                        self.logger.warning(f"No info extracted for {strategy['name']}")
-                        continue
-                    
-                    # Video var mı kontrol et
-                    if not info.get('formats') and not info.get('url'):
-                        self.logger.warning(f"No video formats found for {strategy['name']}")
-                        continue
-                        
-                    title = clean_filename(info.get('title', 'twitter_video'))
-                    self.logger.info(f"Video found: {title}")
-                    
-                    opts['outtmpl']['default'] = os.path.join(temp_dir, f'{title}.%(ext)s')
-                    
-                    # Download
-                    ydl.download([strategy['url']])
-                    
-                    files = os.listdir(temp_dir)
-                    if files:
-                        file_path = os.path.join(temp_dir, files[0])
-                        if os.path.getsize(file_path) > 1024:
-                            self.logger.info(f"Twitter download successful: {file_path}")
-                            return file_path, title
-                            
-            except Exception as e:
-                self.logger.warning(f"Twitter strategy {strategy['name']} failed: {e}")
-                continue
-                
-        raise Exception("All Twitter strategies failed")
+                yield strategy['name'], opts, strategy['url']
+        
+        return self._run_strategies('Twitter', attempts(), temp_dir, 'twitter_video', require_formats=True)
 
-    def _generic_download(self, url, quality, temp_dir):
-        """Diğer platformlar için basit indirme"""
+    def _generic_download(self, url, quality, temp_dir, ie_key=None):
+        """Diğer platformlar için basit indirme; ie_key verilirse yalnızca o extractor denenir"""
+        self._check_cancelled()
+        self.platform = 'generic'
         opts = {
             'format': quality or 'best',
             'quiet': True,
@@ -739,32 +3049,336 @@ class SimpleDownloader:
             'outtmpl': {'default': os.path.join(temp_dir, '%(title)s.%(ext)s')}
         }
         
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if not info:
-                raise Exception("Could not extract video info")
+        strategy = ie_key or 'Generic'
+        STRATEGY_ATTEMPTS.labels(self.platform, strategy).inc()
+        try:
+            result = self._extract_and_download(strategy, opts, url, temp_dir, 'video',
+                                                min_size=0, ie_key=ie_key)
+        except Exception:
+            STRATEGY_FAILURES.labels(self.platform, strategy).inc()
+            raise
+        if not result:
+            STRATEGY_FAILURES.labels(self.platform, strategy).inc()
+            raise Exception("Download failed")
+        return result
+
+    def _run_strategies(self, platform, attempts, temp_dir, default_title, require_formats=False):
+        """Stratejileri sırayla dene, ilk başarılı indirmeyi döndür"""
+        self.platform = platform.lower()
+        attempts = self._cached_first(iter(attempts))
+        if HEDGE_STRATEGIES and HEDGE_WIDTH > 1:
+            result, attempts = self._run_hedged(platform, attempts, temp_dir, default_title,
+                                                require_formats)
+            if result:
+                return result
+        
+        for name, opts, url in attempts:
+            self._check_cancelled()
+            STRATEGY_ATTEMPTS.labels(self.platform, name).inc()
+            try:
+                self.logger.info(f"{platform} strategy: {name}")
+                result = self._extract_and_download(name, opts, url, temp_dir, default_title,
+                                                    require_formats=require_formats)
+                if result:
+                    self.logger.info(f"{platform} {self._phase} successful: {result[0]}")
+                    return result
+                STRATEGY_FAILURES.labels(self.platform, name).inc()
+            except FormatTooLarge:
+                # Video aynı, diğer stratejiler de sığdıramaz
+                raise
+            except Exception as e:
+                STRATEGY_FAILURES.labels(self.platform, name).inc()
+                self.logger.warning(f"{platform} strategy {name} failed: {e}",
+                                    extra={'sample_key': f'{platform}:{name}'})
+                self.logger.debug(f"{platform} strategy {name} full error: {type(e).__name__}: {e}",
+                                  extra={'sample_key': f'{platform}:{name}'})
+                continue
+        
+        raise Exception(f"All {platform} strategies failed")
+
+    @staticmethod
+    def _cached_first(attempts):
+        """info cache'te sonucu olan stratejiyi (ör. /info'nun bulduğu) öne al
+
+        Denemeler sırayla üretilir (proxy seçimi ağ isteği yapabilir); ilk
+        cache'li stratejiye kadar olanlar atlanıp sona bırakılır, yeniden
+        üretilmez. Cache boşsa sıra değişmez.
+        """
+        skipped = []
+        for attempt in attempts:
+            name, _, url = attempt
+            cached = {strategy for strategy, _ in info_cache.for_url(url)}
+            if not cached:
+                return chain(skipped, [attempt], attempts)
+            if name in cached:
+                return chain([attempt], skipped, attempts)
+            skipped.append(attempt)
+        return iter(skipped)
+
+    def _run_hedged(self, platform, attempts, temp_dir, default_title, require_formats):
+        """İlk HEDGE_WIDTH stratejinin extraction'ını HEDGE_DELAY arayla yarıştır
+
+        İlk kullanılabilir info dict'i döndüren strateji indirmeye geçer;
+        başlamamış olanlar iptal edilir, süren extraction'ların sonucu atılır.
+        Kazananın indirmesi başarısız olursa kalanlar sırayla denenir
+        (bitmiş extraction'lar info cache'ten gelir).
+        Dönüş: (sonuç ya da None, sırayla denenecek kalan denemeler)
+        """
+        racers = list(islice(attempts, HEDGE_WIDTH))
+        results = queue.Queue()
+        stop = threading.Event()
+        
+        def extract(position, name, opts, url, hedged):
+            try:
+                if stop.is_set():
+                    return
+                info = self._extract_info(name, opts, url)
+                results.put((position, info, None))
+            except Exception as e:
+                results.put((position, None, e))
+            finally:
+                if hedged:
+                    hedge_limiter.release(platform)
+        
+        tried = set()
+        started = pending = 0
+        next_start = 0
+        winner = None
+        try:
+            while winner is None and (started < len(racers) or pending):
+                self._check_cancelled()
+                now = time.time()
+                if started < len(racers) and (not pending or now >= next_start):
+                    hedged = pending > 0
+                    if not hedged or hedge_limiter.try_acquire(platform):
+                        name, opts, url = racers[started]
+                        STRATEGY_ATTEMPTS.labels(self.platform, name).inc()
+                        self.logger.info(f"{platform} strategy: {name}" + (" (hedged)" if hedged else ""))
+                        threading.Thread(target=extract, args=(started, name, opts, url, hedged),
+                                         name=f'hedge-{platform}-{started}', daemon=True).start()
+                        started += 1
+                        pending += 1
+                    next_start = now + HEDGE_DELAY
+                    continue
                 
-            title = clean_filename(info.get('title', 'video'))
-            opts['outtmpl']['default'] = os.path.join(temp_dir, f'{title}.%(ext)s')
-            
-            ydl.download([url])
+                wait = next_start - now if started < len(racers) else 0.5
+                try:
+                    position, info, error = results.get(timeout=min(max(wait, 0.05), 0.5))
+                except queue.Empty:
+                    continue
+                pending -= 1
+                if self._usable(info, require_formats):
+                    winner = position, info
+                    continue
+                tried.add(position)
+                name = racers[position][0]
+                STRATEGY_FAILURES.labels(self.platform, name).inc()
+                self.logger.warning(f"{platform} strategy {name} failed: {error or 'no usable formats'}",
+                                    extra={'sample_key': f'{platform}:{name}'})
+                # Sıradaki hemen başlasın, sıralı modda da öyle olurdu
+                next_start = 0
+        finally:
+            stop.set()
+            hedge_limiter.record(winner[0] if winner else None)
+        
+        if winner:
+            position, info = winner
+            name, opts, url = racers[position]
+            tried.add(position)
+            self.logger.info(f"{platform} strategy {name} won the race ({position + 1}/{started} started)")
+            try:
+                with ydl_pool.lease(self._with_hooks(opts)) as ydl:
+                    result = self._download_info(ydl, name, info, temp_dir, default_title,
+                                                 require_formats, 1024)
+                if result:
+                    self.logger.info(f"{platform} {self._phase} successful: {result[0]}")
+                    return result, attempts
+                STRATEGY_FAILURES.labels(self.platform, name).inc()
+            except (DownloadCancelled, FormatTooLarge):
+                raise
+            except Exception as e:
+                STRATEGY_FAILURES.labels(self.platform, name).inc()
+                self.logger.warning(f"{platform} strategy {name} failed: {e}",
+                                    extra={'sample_key': f'{platform}:{name}'})
+                info_cache.invalidate(url, name)
+            self._clear_dir(temp_dir)
+        
+        remaining = [racer for i, racer in enumerate(racers) if i not in tried]
+        return None, chain(remaining, attempts)
+
+    def _extract_and_download(self, strategy, opts, url, temp_dir, default_title,
+                              require_formats=False, min_size=1024, ie_key=None):
+        """Bilgiyi bir kez çıkar, indirmeyi aynı info dict'ten yap
+
+        ydl.download([url]) extraction'ı baştan çalıştırırdı; burada
+        process_ie_result ile elimizdeki info kullanılır. Kısa süreli
+        info cache sayesinde tekrar denemeler extraction'ı tamamen atlar.
+        """
+        with ydl_pool.lease(self._with_hooks(opts)) as ydl:
+            info = info_cache.get(url, strategy)
+            if info is not None:
+                try:
+                    return self._download_info(ydl, strategy, info, temp_dir, default_title,
+                                               require_formats, min_size)
+                except (DownloadCancelled, FormatTooLarge):
+                    raise
+                except Exception as e:
+                    # Format URL'leri bayatlamış olabilir, taze extraction yap
+                    self.logger.info(f"Cached info failed for {strategy}, re-extracting: {e}")
+                    info_cache.invalidate(url, strategy)
+                    self._clear_dir(temp_dir)
             
+            with self._timed(EXTRACTION_SECONDS, 'extract', strategy):
+                info = ydl.extract_info(url, download=False, ie_key=ie_key)
+            if not info:
+                return None
+            info_cache.put(url, strategy, ydl.sanitize_info(info))
+            return self._download_info(ydl, strategy, info, temp_dir, default_title,
+                                       require_formats, min_size)
+
+    def _extract_info(self, strategy, opts, url):
+        """Yalnızca extraction; sonuç info cache'e yazılır (hedge yarışı için)"""
+        info = info_cache.get(url, strategy)
+        if info is not None:
+            return info
+        with ydl_pool.lease(self._with_hooks(opts)) as ydl:
+            with self._timed(EXTRACTION_SECONDS, 'extract', strategy):
+                info = ydl.extract_info(url, download=False)
+            if not info:
+                return None
+            info = ydl.sanitize_info(info)
+        info_cache.put(url, strategy, info)
+        return copy.deepcopy(info)
+
+    @property
+    def _phase(self):
+        return 'extraction' if self.extract_only else 'download'
+
+    def _with_hooks(self, opts):
+        opts['progress_hooks'] = [self._progress]
+        # Segmentli formatların fragment'ları sırayla değil paralel iner
+        opts.setdefault('concurrent_fragment_downloads',
+                        FRAGMENT_CONCURRENCY.get(self.platform, FRAGMENT_CONCURRENCY['generic']))
+        return opts
+
+    @staticmethod
+    def _usable(info, require_formats):
+        if not info:
+            return False
+        return not require_formats or bool(info.get('formats') or info.get('url'))
+
+    def _download_info(self, ydl, strategy, info, temp_dir, default_title, require_formats, min_size):
+        # Video var mı kontrol et
+        if not self._usable(info, require_formats):
+            self.logger.warning("No video formats found")
+            return None
+        if self.extract_only:
+            return strategy, ydl.sanitize_info(info)
+        
+        # Bütçe varsa format, medya baytı çekilmeden önce info'dan seçilir
+        selected = info
+        if self.budget is not None:
+            with self._span('select_format'):
+                selected = self.budget.select(info)
+            self.logger.info(f"Format {selected.get('format_id')} selected for budget {self.budget!r}")
+        
+        title = clean_filename(info.get('title') or default_title)
+        ydl.params['outtmpl']['default'] = os.path.join(temp_dir, f'{title}.%(ext)s')
+        
+        # Tek dosyalı progressive formatlar indirilirken stream edilebilir
+        self.title = title
+        self.streamable = (info.get('_type', 'video') == 'video'
+                           and (selected is not info or not info.get('requested_formats'))
+                           and selected.get('protocol') in ('http', 'https'))
+        
+        # Seçilen format bu indirme için sabitlenir; boyutu bilinmeyen formatta
+        # bütçeyi indirme sırasında max_filesize korur. ydl havuza döneceği
+        # için eski değerler geri yazılır.
+        max_filesize = ydl.params.get('max_filesize')
+        strategy_format = ydl.params.get('format')
+        if self.budget is not None:
+            ydl.params['max_filesize'] = min(max_filesize or self.budget.max_bytes, self.budget.max_bytes)
+            if selected.get('format_id'):
+                YDLPool.set_format(ydl, selected['format_id'])
+        try:
+            with self._span('gate'):
+                download_gate.acquire(self.ticket, DownloadGate.estimate(info, selected),
+                                      self._check_cancelled)
+            try:
+                with self._timed(DOWNLOAD_SECONDS, 'download', strategy), bandwidth.track() as slot:
+                    self.bandwidth_slot = slot
+                    ydl.process_ie_result(info, download=True)
+            finally:
+                download_gate.release()
+        finally:
+            self.bandwidth_slot = None
+            ydl.params['max_filesize'] = max_filesize
+            YDLPool.set_format(ydl, strategy_format)
+        
+        with self._span('size_check'):
             files = os.listdir(temp_dir)
             if files:
-                return os.path.join(temp_dir, files[0]), title
-                
-        raise Exception("Download failed")
+                file_path = os.path.join(temp_dir, files[0])
+                if os.path.getsize(file_path) > min_size:
+                    return file_path, title
+            elif self.budget is not None and FormatBudget.estimate_size(selected, info.get('duration')) is None:
+                # yt_dlp, Content-Length bütçeyi aşınca dosyayı hiç yazmaz
+                raise FormatTooLarge(f"Media is larger than the budget ({self.budget!r})")
+        return None
+
+    @staticmethod
+    def _clear_dir(path):
+        for name in os.listdir(path):
+            full = os.path.join(path, name)
+            if os.path.isdir(full):
+                shutil.rmtree(full, ignore_errors=True)
+            else:
+                try:
+                    os.remove(full)
+                except OSError:
+                    pass
+
+download_jobs = JobManager(DownloadPool(JOB_WORKERS, JOB_QUEUE_LIMIT), JOB_TTL)
+
+SERVICE_INFO = {
+    'service': 'ReelDrop API',
+    'version': '4.2-railway-proxy-system',
+    'status': 'running',
+    'features': ['Proxy Support', 'IP Rotation', 'Anti-Bot Protection'],
+    'supported_platforms': ['YouTube', 'Instagram', 'Facebook', 'TikTok', 'Twitter/X', 'Generic']
+}
+
+def proxy_status_info():
+    """Proxy durumunu kontrol et"""
+    proxy = get_random_proxy()
+    return {
+        'proxy_available': proxy is not None,
+        'proxy_info': proxy if proxy else 'No proxy available',
+        'free_proxy_apis': len(FREE_PROXY_APIS),
+        'static_proxies': len(PROXY_LIST)
+    }
+
+def service_stats(jobs):
+    """Cache ve servis istatistikleri"""
+    return {
+        'cache': result_cache.stats(),
+        'info_cache': info_cache.stats(),
+        'short_links': short_links.stats(),
+        'scratch': scratch.stats(),
+        'single_flight': download_flights.stats(),
+        'ydl_pool': ydl_pool.stats(),
+        'hedging': hedge_limiter.stats(),
+        'bandwidth': bandwidth.stats(),
+        'download_gate': download_gate.stats(),
+        'rate_limit': rate_limiter.stats(),
+        'shared_cache': shared_cache.stats(),
+        'jobs': jobs.stats()
+    }
 
 # Routes
 @app.route('/')
 def home():
-    return jsonify({
-        'service': 'ReelDrop API',
-        'version': '4.2-railway-proxy-system',
-        'status': 'running',
-        'features': ['Proxy Support', 'IP Rotation', 'Anti-Bot Protection'],
-        'supported_platforms': ['YouTube', 'Instagram', 'Facebook', 'TikTok', 'Twitter/X', 'Generic']
-    })
+    return jsonify(SERVICE_INFO)
 
 @app.route('/health')
 def health():
@@ -773,105 +3387,732 @@ def health():
 @app.route('/proxy-status')
 def proxy_status():
     """Proxy durumunu kontrol et"""
-    proxy = get_random_proxy()
-    return jsonify({
-        'proxy_available': proxy is not None,
-        'proxy_info': proxy if proxy else 'No proxy available',
-        'free_proxy_apis': len(FREE_PROXY_APIS),
-        'static_proxies': len(PROXY_LIST)
-    })
+    return jsonify(proxy_status_info())
+
+@app.route('/stats')
+def stats():
+    """Cache ve servis istatistikleri"""
+    return jsonify(service_stats(download_jobs))
+
+@app.route('/metrics')
+def metrics():
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+def timed_close(platform, mode, on_close=None, trace=None):
+    """Yanıt gövdesi kapanınca gönderim süresini ölçen on_close"""
+    started = time.time()
+    def done():
+        elapsed = time.time() - started
+        STREAM_SECONDS.labels(platform, mode).observe(elapsed)
+        if trace is not None:
+            trace.add('serve', started, elapsed, mode)
+        if on_close:
+            on_close()
+    return done
+
+def is_valid_url(url):
+    # URL validation - daha esnek
+    return url.startswith(('http://', 'https://')) or url.startswith('www.')
+
+def info_summary(info, strategy, budget=None):
+    """UI için kırpılmış info: başlık, süre, küçük resim ve tahmini boyutlu formatlar"""
+    duration = info.get('duration')
+    formats = []
+    for f in info.get('formats') or [info]:
+        if f.get('vcodec') == 'none' and f.get('acodec') == 'none':
+            continue  # storyboard / mhtml
+        size = FormatBudget.estimate_size(f, duration)
+        estimated = bool(size) and not f.get('filesize')
+        formats.append({
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'width': f.get('width'),
+            'height': f.get('height'),
+            'fps': f.get('fps'),
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'filesize': size,
+            'filesize_estimated': estimated
+        })
+    summary = {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'duration': duration,
+        'thumbnail': info.get('thumbnail'),
+        'uploader': info.get('uploader'),
+        'webpage_url': info.get('webpage_url'),
+        'extractor': info.get('extractor_key') or info.get('extractor'),
+        'strategy': strategy,
+        'heights': sorted({f['height'] for f in formats if f['height']}, reverse=True),
+        'formats': formats
+    }
+    if budget is not None:
+        # Aynı bütçeyle /download'un seçeceği format
+        try:
+            summary['selected_format'] = budget.select(info).get('format_id')
+        except FormatTooLarge as e:
+            summary['selected_format'] = None
+            summary['budget_error'] = str(e)
+    return summary
+
+def busy_response(error):
+    """Kuyruk doluyken 503 + Retry-After"""
+    response = jsonify({'error': 'Server busy, try again later', 'retry_after': error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def request_client():
+    """İsteği yapan istemci: X-API-Key, yoksa (proxy arkasındaki) IP"""
+    return ClientQuota.resolve(request.headers.get('X-API-Key'), request.remote_addr,
+                               request.headers.get('X-Forwarded-For'))
+
+def rate_limited_response(error):
+    """İstemci kotası dolu: 429 + Retry-After"""
+    response = jsonify({'error': 'Rate limit exceeded', 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def file_etag(file_path):
+    """Dosya içeriği değişince değişen güçlü ETag
+
+    Cache hit'leri veri dosyasının mtime'ına dokunmaz; aynı dosya için
+    ETag istekler arasında sabit kalır, If-Range ile devam edilebilir.
+    """
+    st = os.stat(file_path)
+    return f'"{st.st_ino:x}-{st.st_size:x}-{int(st.st_mtime):x}"'
+
+def parse_byte_ranges(header, size):
+    """Range başlığını [(başlangıç, bitiş_hariç), ...] listesine çevir
+
+    Geçersiz başlıkta None (tüm dosya gönderilir), karşılanamayan
+    aralıklarda boş liste (416) döner. Çakışan/bitişik aralıklar
+    birleştirilir; MAX_BYTE_RANGES'ten fazla aralık ya da toplamı dosyadan
+    büyük istek (aynı baytları tekrar tekrar isteyen yükseltme) tüm dosyayı alır.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    parts = header[len('bytes='):].split(',')
+    if len(parts) > MAX_BYTE_RANGES:
+        return None
+    ranges = []
+    for part in parts:
+        part = part.strip()
+        if '-' not in part:
+            return None
+        first, last = part.split('-', 1)
+        try:
+            if first:
+                start = int(first)
+                stop = int(last) + 1 if last else size
+                if last and stop <= start:
+                    return None
+            else:
+                # bytes=-N: son N bayt
+                suffix = int(last)
+                start, stop = max(size - suffix, 0), size
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(stop, size)))
+    if sum(stop - start for start, stop in ranges) > size:
+        return None
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+class _FileSlice:
+    """Dosyanın bir aralığını okuyan file-like; kapanınca on_close çağrılır
+
+    fileno() yalnızca dosyanın tamamı gönderilirken çalışır: gunicorn
+    sendfile her zaman 0. bayttan başlar, aralıklar blok blok okunur.
+    direct_passthrough gövdelerde Response.close hiç çağrılmadığı için
+    temizlik sunucunun kapattığı bu nesneden yapılır.
+    """
+
+    def __init__(self, f, start=0, length=None, on_close=None):
+        self.f = f
+        self.whole = start == 0 and length is None
+        self.remaining = os.fstat(f.fileno()).st_size if length is None else length
+        self.length = self.remaining
+        self.on_close = on_close
+        self.sendfile = False
+        f.seek(start)
+
+    def fileno(self):
+        if not self.whole:
+            raise io.UnsupportedOperation('fileno')
+        self.sendfile = True
+        return self.f.fileno()
+
+    def seek(self, offset, whence=0):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if not self.f.closed:
+            # sendfile read() çağırmaz; gunicorn dosyayı tamamen gönderdi sayılır
+            sent = self.length - self.remaining
+            BYTES_SERVED.inc(self.length if self.sendfile and not sent else sent)
+        try:
+            self.f.close()
+        finally:
+            if on_close:
+                on_close()
+
+def file_response(file_path, title, cache_hit, on_close=None):
+    """Dosyayı sendfile/file_wrapper ile, Range desteğiyle gönder"""
+    f = open(file_path, 'rb')
+    try:
+        file_size = os.fstat(f.fileno()).st_size
+        etag = file_etag(file_path)
+        # Cache dosyaları .data uzantılı; tip dosya başlığından okunur
+        ext, content_type = sniff_media(f) or media_type_for(file_path)
+        headers = {
+            'Content-Disposition': f'attachment; filename="{title}.{ext}"',
+            'Cache-Control': 'no-cache',
+            'Accept-Ranges': 'bytes',
+            'ETag': etag,
+            'X-Cache': 'HIT' if cache_hit else 'MISS'
+        }
+        
+        ranges = parse_byte_ranges(request.headers.get('Range'), file_size)
+        if_range = request.headers.get('If-Range')
+        if ranges is not None and if_range and if_range.strip() != etag:
+            # Dosya değişmiş, aralık yerine tamamını gönder
+            ranges = None
+        
+        if ranges is None:
+            headers['Content-Length'] = str(file_size)
+            body = wrap_file(request.environ, _FileSlice(f, on_close=on_close),
+                             buffer_size=SEND_BUFFER_SIZE)
+            status = 200
+        elif not ranges:
+            f.close()
+            response = Response(status=416, headers={'Content-Range': f'bytes */{file_size}'})
+            if on_close:
+                response.call_on_close(on_close)
+            return response
+        elif len(ranges) == 1:
+            start, stop = ranges[0]
+            headers['Content-Length'] = str(stop - start)
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{file_size}'
+            body = wrap_file(request.environ, _FileSlice(f, start, stop - start, on_close),
+                             buffer_size=SEND_BUFFER_SIZE)
+            status = 206
+        else:
+            body, length, content_type = _multipart_ranges(f, ranges, file_size, content_type,
+                                                         on_close)
+            headers['Content-Length'] = str(length)
+            status = 206
+    except Exception:
+        f.close()
+        raise
+    
+    # on_close gövde kapanınca çağrılır: passthrough'da call_on_close çalışmaz
+    return Response(body, status=status, content_type=content_type,
+                    headers=headers, direct_passthrough=True)
+
+def _multipart_ranges(f, ranges, file_size, content_type, on_close=None):
+    """Çoklu aralık için multipart/byteranges gövdesi (üreteç, uzunluk, tip)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, stop in ranges:
+        head = (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{stop - 1}/{file_size}\r\n\r\n').encode('ascii')
+        parts.append((head, start, stop))
+    tail = f'--{boundary}--\r\n'.encode('ascii')
+    length = sum(len(head) + (stop - start) + 2 for head, start, stop in parts) + len(tail)
+    
+    def generate():
+        for head, start, stop in parts:
+            yield head
+            piece = _FileSlice(f, start, stop - start)
+            while True:
+                chunk = piece.read(SEND_BUFFER_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            yield b'\r\n'
+        yield tail
+    
+    # Üreteç hiç başlamadan kapatılsa da dosya ve on_close kapanır
+    callbacks = [f.close] + ([on_close] if on_close else [])
+    body = ClosingIterator(generate(), callbacks)
+    return body, length, f'multipart/byteranges; boundary={boundary}'
+
+def stream_response(flight, f, title, on_close=None):
+    """yt_dlp hâlâ yazarken açık dosyayı takip ederek chunked stream et"""
+    def generate():
+        with f:
+            while True:
+                # Okumadan önce bakılmalı, yoksa son baytlar kaçabilir
+                finished = flight.event.is_set()
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if chunk:
+                    BYTES_SERVED.inc(len(chunk))
+                    yield chunk
+                    continue
+                if flight.stream_broken or (finished and flight.error):
+                    # Eksik gövde; bağlantıyı keserek istemciye bildir
+                    raise IOError(f"Pass-through stream aborted for {title}")
+                if finished:
+                    break
+                flight.event.wait(0.05)
+    
+    # Son boyut bilinmiyor, Content-Length yok -> chunked transfer
+    # Başlık henüz yazılmamış olabilir; tip yt_dlp'nin seçtiği uzantıdan
+    ext, content_type = media_type_for(f.name.removesuffix('.part'))
+    response = Response(
+        stream_with_context(generate()),
+        content_type=content_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{title}.{ext}"',
+            'Cache-Control': 'no-cache',
+            'X-Cache': 'MISS',
+            'X-Stream': 'passthrough'
+        }
+    )
+    # Gövde hiç okunmadan kapanırsa dosya da kapansın
+    response.call_on_close(f.close)
+    if on_close:
+        response.call_on_close(on_close)
+    return response
+
+class _ZipSink(io.RawIOBase):
+    """zipfile'ın yazdığı baytları biriktirir; seek yok, zipfile data descriptor kullanır"""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.offset += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.offset
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def parse_batch_request(data):
+    """(urls, quality, bütçe, hata) döndür"""
+    urls = data.get('urls') if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not urls:
+        return None, None, None, 'urls (non-empty list) required'
+    if len(urls) > BATCH_MAX_URLS:
+        return None, None, None, f'At most {BATCH_MAX_URLS} URLs per batch'
+    urls = [str(url).strip() for url in urls]
+    invalid = [url for url in urls if not is_valid_url(url)]
+    if invalid:
+        return None, None, None, f'Invalid URL format: {invalid[0]}'
+    budget, error = FormatBudget.from_request(data)
+    if error:
+        return None, None, None, error
+    return urls, data.get('quality', 'best[height<=720]/best'), budget, None
+
+def batch_zip_stream(jobs, urls, quality, request_id, concurrency=BATCH_CONCURRENCY, budget=None,
+                     client=None):
+    """URL'leri en fazla `concurrency` eşzamanlı işle indir, biten her dosyayı
+    stored ZIP girdisi olarak hemen akıt; en sona manifest.json ekle
+    """
+    started = time.time()
+    results = queue.Queue()
+    pending = deque(enumerate(urls))
+    active = {}
+    manifest = [None] * len(urls)
+    
+    def fail(index, url, error):
+        manifest[index] = {'url': url, 'status': 'failed', 'error': error}
+    
+    def start_more():
+        while pending and len(active) < concurrency:
+            index, url = pending.popleft()
+            try:
+                job = jobs.submit(canonicalize_url(url), quality, budget, client)
+            except PoolSaturated:
+                if active:
+                    # Bu batch'in bir işi bitince yeniden denenir
+                    pending.appendleft((index, url))
+                    return
+                fail(index, url, 'Server busy')
+                continue
+            active[index] = job
+            if job.flight is None:
+                results.put(index)
+            else:
+                job.flight.add_done_callback(lambda index=index: results.put(index))
+    
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED)
+    try:
+        start_more()
+        while active:
+            try:
+                index = results.get(timeout=DOWNLOAD_TIMEOUT * 2)
+            except queue.Empty:
+                for index in list(active):
+                    fail(index, urls[index], 'Download timeout')
+                    jobs.discard(active.pop(index))
+                # Hiç başlamamış URL'ler de manifest'te yer almalı
+                while pending:
+                    fail(*pending.popleft(), 'Batch timeout')
+                break
+            job = active.pop(index)
+            try:
+                file_path, title = job.wait(0)
+                with open(file_path, 'rb') as src:
+                    ext = (sniff_media(src) or media_type_for(file_path))[0]
+                    name = f'{index + 1:02d}_{title}.{ext}'
+                    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                    info.file_size = os.fstat(src.fileno()).st_size
+                    with archive.open(info, 'w') as entry:
+                        while True:
+                            chunk = src.read(SEND_BUFFER_SIZE)
+                            if not chunk:
+                                break
+                            entry.write(chunk)
+                            data = sink.drain()
+                            BYTES_SERVED.inc(len(data))
+                            yield data
+                manifest[index] = {'url': urls[index], 'status': 'ok', 'file': name,
+                                   'size': info.file_size, 'cache': job.cached is not None}
+            except Exception as e:
+                fail(index, urls[index], 'Download timeout' if isinstance(e, TimeoutError) else str(e))
+            finally:
+                jobs.discard(job)
+            start_more()
+        
+        archive.writestr('manifest.json', json.dumps({'request_id': request_id, 'entries': manifest},
+                                                     ensure_ascii=False, indent=2))
+        archive.close()
+        data = sink.drain()
+        BYTES_SERVED.inc(len(data))
+        yield data
+        failed = sum(1 for entry in manifest if entry['status'] != 'ok')
+        log_trace(request_id, started, [], path='/download/batch', urls=len(urls), failed=failed)
+    finally:
+        # İstemci koptuysa kalan işler bırakılır (son referanssa iptal edilir)
+        for job in active.values():
+            jobs.discard(job)
+
+@app.route('/download/batch', methods=['POST'])
+def download_batch():
+    """Birden çok URL'yi tek bir akan ZIP olarak indir"""
+    request_id = uuid.uuid4().hex
+    urls, quality, budget, error = parse_batch_request(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+    client = request_client()
+    try:
+        # Her URL bir token
+        rate_limiter.acquire(client, len(urls))
+    except RateLimited as e:
+        return rate_limited_response(e)
+    logger.info(f"[{request_id}] Batch started: {len(urls)} URLs")
+    response = Response(batch_zip_stream(download_jobs, urls, quality, request_id, budget=budget,
+                                         client=client),
+                        content_type='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename="reeldrop-batch.zip"',
+                                 'Cache-Control': 'no-cache',
+                                 'X-Request-ID': request_id})
+    return response
+
+@app.route('/info', methods=['GET', 'POST'])
+def video_info():
+    """İndirmeden video bilgisi (başlık, süre, kaliteler)"""
+    start_time = time.time()
+    data = request.get_json(silent=True) if request.method == 'POST' else request.args
+    url = str((data or {}).get('url') or '').strip()
+    if not url:
+        return jsonify({'error': 'URL required'}), 400
+    if not is_valid_url(url):
+        return jsonify({'error': 'Invalid URL format', 'received_url': url}), 400
+    
+    budget, error = FormatBudget.from_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    client = request_client()
+    try:
+        rate_limiter.acquire(client)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    
+    url = canonicalize_url(url)
+    # Extraction indirmelerle aynı sınırlı havuzda; request thread'leri tükenmesin
+    future = None
+    try:
+        future = download_jobs.pool.call(SimpleDownloader().extract_with_timeout, url,
+                                         client=client.id, weight=client.weight)
+        strategy, info = future.result(INFO_TIMEOUT * 2)
+    except PoolSaturated as e:
+        return busy_response(e)
+    except (TimeoutError, FutureTimeout):
+        # Kuyrukta bekliyorsa hiç çalışmasın
+        if future is not None:
+            future.cancel()
+        return jsonify({'error': 'Extraction timeout'}), 408
+    except Exception as e:
+        logger.error(f"Info error: {e}")
+        return jsonify({'error': 'Video bilgisi alınamadı'}), 500
+    
+    body = info_summary(info, strategy, budget)
+    body['platform'] = detect_platform(url)
+    body['processing_time'] = round(time.time() - start_time, 2)
+    return jsonify(body)
+
+def peer_authorized(token):
+    """/cache/fill yalnızca replikalardan; token tanımlı değilse route kapalıdır"""
+    return bool(CACHE_PEER_TOKEN) and hmac.compare_digest(token or '', CACHE_PEER_TOKEN)
+
+def fill_deadline():
+    """Sahip, isteyen replikanın CACHE_FILL_TIMEOUT'u dolmadan cevap versin"""
+    return time.time() + max(CACHE_FILL_TIMEOUT - 5, 1)
+
+@app.route('/cache/fill', methods=['POST'])
+def cache_fill():
+    """Sahibi olduğumuz anahtarı indirip paylaşımlı cache'e yaz (replikalar arası)"""
+    if not peer_authorized(request.headers.get('X-Cache-Token')):
+        return jsonify({'error': 'Forbidden'}), 403
+    if not shared_cache.enabled:
+        return jsonify({'error': 'Shared cache disabled'}), 404
+    data = request.get_json(silent=True)
+    if not data or not data.get('url'):
+        return jsonify({'error': 'URL required'}), 400
+    budget, error = FormatBudget.from_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # İstemci kotası isteği yapan replikada zaten düşüldü
+    url, quality = data['url'], data.get('quality', 'best[height<=720]/best')
+    try:
+        job = download_jobs.submit(url, quality, budget, local_only=True)
+    except PoolSaturated as e:
+        return busy_response(e)
+    deadline = fill_deadline()
+    try:
+        file_path, title = job.wait(deadline - time.time())
+        stored = shared_cache.ensure_stored(job.key, file_path, title, max(deadline - time.time(), 0))
+    except FormatTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except TimeoutError:
+        return jsonify({'error': 'Fill timeout'}), 504
+    except Exception as e:
+        logger.error(f"Cache fill failed for {url}: {e}")
+        return jsonify({'error': 'Fill failed'}), 502
+    finally:
+        # Zaman aşımında indirme sürer ve bitince paylaşımlı cache'e yine yazılır;
+        # son referansı şimdi bırakmak onu iptal ederdi
+        download_jobs.discard_when_done(job)
+    if not stored:
+        return jsonify({'error': 'Shared cache write failed'}), 502
+    shared_cache.filled()
+    return jsonify({'key': job.key, 'cache_hit': job.cached is not None})
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """İndirme işini kuyruğa al, hemen job id döndür"""
+    data = request.get_json(silent=True)
+    if not data or 'url' not in data:
+        return jsonify({'error': 'URL required'}), 400
+    
+    url = data['url'].strip()
+    quality = data.get('quality', 'best[height<=720]/best')
+    if not is_valid_url(url):
+        return jsonify({'error': 'Invalid URL format', 'received_url': url}), 400
+    
+    budget, error = FormatBudget.from_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    client = request_client()
+    try:
+        rate_limiter.acquire(client)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    
+    url = canonicalize_url(url)
+    try:
+        job = download_jobs.submit(url, quality, budget, client)
+    except PoolSaturated as e:
+        return busy_response(e)
+    logger.info(f"[{job.id}] Job submitted: {url}")
+    
+    body = job.to_dict()
+    body['status_url'] = f'/jobs/{job.id}'
+    body['file_url'] = f'/jobs/{job.id}/file'
+    return jsonify(body), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = download_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/file')
+def job_file(job_id):
+    job = download_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    status = job.status
+    if status == 'failed':
+        return jsonify(job.to_dict()), 500
+    if status != 'finished':
+        return jsonify(job.to_dict()), 409
+    
+    file_path, title = job.wait()
+    try:
+        return file_response(file_path, title, job.cached is not None,
+                             on_close=timed_close(detect_platform(job.url), 'file'))
+    except OSError:
+        # Cache'ten düşmüş olabilir
+        return jsonify({'error': 'Result expired'}), 410
 
 @app.route('/download', methods=['POST'])
 def download_video():
     start_time = time.time()
-    request_id = f"req_{int(time.time())}"
+    request_id = uuid.uuid4().hex
+    trace = Trace()
+    job = None
+    
+    def spans():
+        # İstek fazları + (varsa) paylaşılan indirme uçuşunun fazları
+        result = trace.snapshot()
+        if job is not None and job.flight is not None:
+            result += job.flight.trace.snapshot()
+        return result
+    
+    def timed(response):
+        response.headers['Server-Timing'] = server_timing(spans(), time.time() - start_time)
+        response.headers['X-Request-ID'] = request_id
+        return response
     
-    # Console'a da yazdır
-    print(f"\n[{request_id}] NEW REQUEST RECEIVED")
+    def respond(rv, **fields):
+        # Gövdesiz/JSON yanıtlar: trace satırı hemen yazılır
+        response = timed(make_response(rv))
+        log_trace(request_id, start_time, spans(), status=response.status_code, **fields)
+        return response
     
     try:
         data = request.get_json()
         if not data or 'url' not in data:
-            return jsonify({'error': 'URL required'}), 400
+            return respond((jsonify({'error': 'URL required'}), 400))
         
         url = data['url'].strip()
         quality = data.get('quality', 'best[height<=720]/best')
         
         logger.info(f"[{request_id}] Download started: {url}")
-        logger.info(f"[{request_id}] URL length: {len(url)}")
-        logger.info(f"[{request_id}] URL analysis: {url.lower()}")
-        
-        # URL debug için
-        if 'x.com' in url.lower():
-            logger.info(f"[{request_id}] X.com detected!")
-        elif 'twitter.com' in url.lower():
-            logger.info(f"[{request_id}] Twitter.com detected!")
-        elif 'tiktok.com' in url.lower():
-            logger.info(f"[{request_id}] TikTok.com detected!")
-        elif 'youtube' in url.lower() or 'youtu.be' in url.lower():
-            logger.info(f"[{request_id}] YouTube detected - using proxy system!")
-        else:
-            logger.info(f"[{request_id}] Platform not detected, will try fallback")
-        
-        # URL validation - daha esnek
-        if not (url.startswith(('http://', 'https://')) or url.startswith('www.')):
+        if not is_valid_url(url):
             logger.error(f"[{request_id}] Invalid URL format: {url}")
-            return jsonify({'error': 'Invalid URL format', 'received_url': url}), 400
+            return respond((jsonify({'error': 'Invalid URL format', 'received_url': url}), 400))
+        budget, error = FormatBudget.from_request(data)
+        if error:
+            return respond((jsonify({'error': error}), 400))
+        client = request_client()
+        try:
+            rate_limiter.acquire(client)
+        except RateLimited as e:
+            logger.info(f"[{request_id}] Rate limited: {client.id}")
+            return respond(rate_limited_response(e), client=client.id)
         
-        downloader = SimpleDownloader()
+        with trace.span('canonicalize'):
+            url = canonicalize_url(url)
+        platform = detect_platform(url)
+        logger.info(f"[{request_id}] Platform: {platform} ({url})")
         
+        # Senkron endpoint, job API üzerinde ince bir sarmalayıcı
+        try:
+            with trace.span('admit'):
+                job = download_jobs.submit(url, quality, budget, client)
+        except PoolSaturated as e:
+            logger.warning(f"[{request_id}] Rejected: {e}")
+            return respond(busy_response(e), platform=platform)
         try:
-            file_path, title = downloader.download_with_timeout(url, quality)
+            # Range isteyen istemciye tamamlanmış dosya gerekir
+            with trace.span('wait'):
+                if data.get('stream', STREAM_PASSTHROUGH) and 'Range' not in request.headers:
+                    # Akışta kaynak, yazılmakta olan dosyanın açık nesnesidir
+                    source, title, streaming = job.wait_stream(DOWNLOAD_TIMEOUT)
+                else:
+                    source, title = job.wait(DOWNLOAD_TIMEOUT)
+                    streaming = False
+            
+            mode = 'passthrough' if streaming else 'file'
+            cache_hit = job.cached is not None
+            
+            def closed():
+                # Gövde gönderilip kapanınca: işi bırak, trace satırını yaz
+                download_jobs.discard(job)
+                log_trace(request_id, start_time, spans(), status=status, platform=platform,
+                          mode=mode, cache='HIT' if cache_hit else 'MISS', job_id=job.id)
+            
+            on_close = timed_close(platform, mode, closed, trace)
+            if streaming:
+                response = stream_response(job.flight, source, title, on_close=on_close)
+            else:
+                response = file_response(source, title, cache_hit, on_close=on_close)
+            status = response.status_code
         except TimeoutError:
-            return jsonify({'error': 'Download timeout'}), 408
+            # Son referans bırakılınca indirme iptal edilir
+            DOWNLOAD_TIMEOUTS.labels(platform).inc()
+            download_jobs.discard(job)
+            return respond((jsonify({'error': 'Download timeout'}), 408), platform=platform)
+        except PoolSaturated as e:
+            download_jobs.discard(job)
+            return respond(busy_response(e), platform=platform)
+        except FormatTooLarge as e:
+            download_jobs.discard(job)
+            logger.info(f"[{request_id}] Rejected: {e}")
+            return respond((jsonify({'error': str(e)}), 413), platform=platform)
+        except Exception:
+            download_jobs.discard(job)
+            raise
         
-        file_size = os.path.getsize(file_path)
-        temp_dir = os.path.dirname(file_path)
         processing_time = round(time.time() - start_time, 2)
-        
-        logger.info(f"[{request_id}] Success: {title} ({file_size} bytes, {processing_time}s)")
-        
-        def generate():
-            try:
-                with open(file_path, 'rb') as f:
-                    while True:
-                        chunk = f.read(8192)
-                        if not chunk:
-                            break
-                        yield chunk
-            finally:
-                try:
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-                except:
-                    pass
-        
-        return Response(
-            stream_with_context(generate()),
-            content_type='video/mp4',
-            headers={
-                'Content-Length': str(file_size),
-                'Content-Disposition': f'attachment; filename="{title}.mp4"',
-                'Cache-Control': 'no-cache'
-            }
-        )
+        if cache_hit:
+            logger.info(f"[{request_id}] Cache hit: {title}")
+        if streaming:
+            logger.info(f"[{request_id}] Streaming: {title} (first byte after {processing_time}s)")
+        else:
+            logger.info(f"[{request_id}] Success: {title} ({response.content_length} bytes, {processing_time}s)")
+        return timed(response)
         
     except Exception as e:
         processing_time = round(time.time() - start_time, 2)
         logger.error(f"[{request_id}] Error: {str(e)} ({processing_time}s)")
         
-        return jsonify({
+        return respond((jsonify({
             'error': 'Video indirilemedi',
             'processing_time': processing_time,
             'details': str(e) if app.debug else None
-        }), 500
+        }), 500), error=str(e))
 
 if __name__ == '__main__':
-    print(f"Starting ReelDrop API v4.2-railway-proxy-system on port {PORT}")
-    print("Features: Proxy Support, IP Rotation, Anti-Bot Protection")
-    print("Supported platforms: YouTube, Instagram, Facebook, TikTok, Twitter/X")
-    print("Press Ctrl+C to stop")
-    print("=" * 50)
-    
     logger.info(f"Starting ReelDrop API v4.2-railway-proxy-system on port {PORT}")
     logger.info("Features: Proxy Support, IP Rotation, Anti-Bot Protection")
     logger.info("Supported platforms: YouTube, Instagram, Facebook, TikTok, Twitter/X")
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ASGI giriş noktası: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+# HTTP tarafı async, yt_dlp extraction/indirme işleri process havuzunda
+# çalışır; böylece GIL istek karşılama ile paylaşılmaz.
+# Bu modda SJF indirme kapısı yoktur: her alt process tek iş çalıştırır,
+# işler havuza geliş (adil kuyruk) sırasıyla girer; iş durumunda
+# 'waiting_for_download' aşaması ve /stats'ta download_gate görünmez.
+
+import os
+import time
+import uuid
+import asyncio
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, FileResponse, StreamingResponse
+from starlette.routing import Route
+from yt_dlp.utils import DownloadCancelled
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+from app import (
+    BANDWIDTH_LIMIT, BYTES_SERVED, DOWNLOAD_TIMEOUT, DOWNLOAD_TIMEOUTS, INFO_TIMEOUT,
+    JOB_QUEUE_LIMIT, JOB_TTL, SERVICE_INFO, STREAM_SECONDS, ClientQuota, DownloadPool,
+    FormatBudget, FormatTooLarge, JobManager, PoolSaturated, RateLimited, SimpleDownloader,
+    TimeoutError, Trace, batch_zip_stream, canonicalize_url, detect_platform, file_etag,
+    fill_deadline, info_cache, info_summary, is_valid_url, log_trace, logger, media_type_for,
+    parse_batch_request, peer_authorized, proxy_status_info, rate_limiter, scratch,
+    server_timing, service_stats, shared_cache, sniff_media
+)
+
+# Process havuzu ayarları
+PROCESS_WORKERS = int(os.environ.get('ASGI_PROCESS_WORKERS', os.cpu_count() or 2))
+DRAIN_TIMEOUT = int(os.environ.get('ASGI_DRAIN_TIMEOUT', DOWNLOAD_TIMEOUT))
+
+# Alt process'ler app.log'u ayrıca döndürmesin; onların logları stdout'a gider
+os.environ['LOG_FILE'] = ''
+# Bant genişliği bütçesi alt process'ler arasında eşit bölünür
+if BANDWIDTH_LIMIT:
+    os.environ['BANDWIDTH_LIMIT'] = str(max(BANDWIDTH_LIMIT // PROCESS_WORKERS, 1))
+
+# spawn: ana process'teki thread'ler fork ile kopyalanmasın
+process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS,
+                                   mp_context=multiprocessing.get_context('spawn'))
+
+def _download_in_process(url, quality, budget=None, seed=()):
+    """Alt process'te çalışır; dosya paylaşılan diskte bırakılır"""
+    # /info'nun ana process'te tuttuğu info dict'leri: extraction atlanır
+    for strategy, info in seed:
+        info_cache.put(url, strategy, info)
+    trace = Trace()
+    try:
+        result = SimpleDownloader(trace=trace, budget=budget).download_with_timeout(url, quality)
+        # Klasör artık ana process'in
+        scratch.detach(os.path.dirname(result[0]))
+        return result, trace.spans
+    except Exception as e:
+        # Span'ler hata yolunda da ana process'e taşınsın
+        e.spans = trace.spans
+        raise
+
+def _info_in_process(url):
+    return SimpleDownloader().extract_with_timeout(url)
+
+def info_via_process(url):
+    """Havuz thread'inde çalışır: extraction'ı process havuzuna gönder ve bekle"""
+    return process_pool.submit(_info_in_process, url).result()
+
+def download_in_process(url, quality, flight, budget=None):
+    """JobManager için indirici: işi process havuzuna gönder ve bekle"""
+    future = process_pool.submit(_download_in_process, url, quality, budget,
+                                 info_cache.for_url(url))
+    while True:
+        try:
+            result, spans = future.result(timeout=0.5)
+            flight.trace.extend(spans)
+            scratch.adopt(os.path.dirname(result[0]))
+            return result
+        except FutureTimeout:
+            # Henüz başlamamışsa iptal edilebilir; başlamışsa süre sınırı keser
+            if flight.cancelled.is_set() and future.cancel():
+                raise DownloadCancelled('Download cancelled')
+        except Exception as e:
+            flight.trace.extend(getattr(e, 'spans', ()))
+            raise
+
+# Her havuz thread'i bir process sonucunu bekler
+process_jobs = JobManager(DownloadPool(PROCESS_WORKERS, JOB_QUEUE_LIMIT), JOB_TTL,
+                          download=download_in_process)
+
+draining = False
+
+def _error(message, status, **extra):
+    return JSONResponse({'error': message, **extra}, status_code=status)
+
+def _busy(error):
+    return JSONResponse({'error': 'Server busy, try again later', 'retry_after': error.retry_after},
+                        status_code=503, headers={'Retry-After': str(error.retry_after)})
+
+def _rate_limited(error):
+    return JSONResponse({'error': 'Rate limit exceeded', 'retry_after': error.retry_after},
+                        status_code=429, headers={'Retry-After': str(error.retry_after)})
+
+def _client(request):
+    return ClientQuota.resolve(request.headers.get('x-api-key'),
+                               request.client.host if request.client else None,
+                               request.headers.get('x-forwarded-for'))
+
+async def _read_download_request(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'url' not in data:
+        return None, _error('URL required', 400)
+    url = str(data['url']).strip()
+    if not is_valid_url(url):
+        return None, _error('Invalid URL format', 400, received_url=url)
+    budget, error = FormatBudget.from_request(data)
+    if error:
+        return None, _error(error, 400)
+    # Kısa link çözümü ağ isteği yapabilir, event loop'u bloklamasın
+    url = await run_in_threadpool(canonicalize_url, url)
+    return (url, data.get('quality', 'best[height<=720]/best'), budget), None
+
+async def _submit(url, quality, budget=None, client=None, local_only=False):
+    if draining:
+        raise PoolSaturated(DRAIN_TIMEOUT)
+    # Cache anahtarı ve disk kontrolü event loop'u bloklamasın
+    return await run_in_threadpool(process_jobs.submit, url, quality, budget, client, local_only)
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+async def wait_for_job(job, timeout):
+    """İş bitene kadar thread bloklamadan bekle"""
+    if not job.done:
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        job.flight.add_done_callback(lambda: loop.call_soon_threadsafe(_set_done, done))
+        try:
+            await asyncio.wait_for(done, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Download timeout after {timeout} seconds")
+    return job.wait(0)
+
+def _file_response(request, url, file_path, title, cache_hit, on_close=None, trace=None):
+    # FileResponse dosyayı async okur, Range/ETag desteği içerir
+    started = time.time()
+    size = None if 'range' in request.headers else os.path.getsize(file_path)
+    
+    def done():
+        elapsed = time.time() - started
+        STREAM_SECONDS.labels(detect_platform(url), 'file').observe(elapsed)
+        if trace is not None:
+            trace.add('serve', started, elapsed, 'file')
+        if size is not None:
+            BYTES_SERVED.inc(size)
+        if on_close:
+            on_close()
+    
+    # Cache dosyaları .data uzantılı; tip dosya başlığından okunur
+    with open(file_path, 'rb') as f:
+        ext, media_type = sniff_media(f) or media_type_for(file_path)
+    return FileResponse(
+        file_path,
+        media_type=media_type,
+        filename=f'{title}.{ext}',
+        # Starlette'in kendi ETag'i de mtime'dan; Flask tarafıyla aynı doğrulayıcı kullanılsın
+        headers={'Cache-Control': 'no-cache', 'ETag': file_etag(file_path),
+                 'X-Cache': 'HIT' if cache_hit else 'MISS'},
+        background=BackgroundTask(done)
+    )
+
+async def home(request):
+    return JSONResponse(SERVICE_INFO)
+
+async def health(request):
+    return PlainTextResponse('OK')
+
+async def proxy_status(request):
+    return JSONResponse(await run_in_threadpool(proxy_status_info))
+
+async def stats(request):
+    data = service_stats(process_jobs)
+    data['process_pool'] = {'workers': PROCESS_WORKERS, 'draining': draining}
+    # Ana process'in kapısından hiçbir indirme geçmez; sıfırları göstermeyelim
+    del data['download_gate']
+    # İndirmeler alt process'lerde; buradaki governor yalnızca toplam bütçeyi gösterir
+    data['bandwidth']['per_process_limit_bps'] = (max(BANDWIDTH_LIMIT // PROCESS_WORKERS, 1)
+                                                  if BANDWIDTH_LIMIT else None)
+    return JSONResponse(data)
+
+async def metrics(request):
+    # PROMETHEUS_MULTIPROC_DIR ayarlıysa alt process'lerin histogramları da toplanır
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return PlainTextResponse(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+async def download_video(request):
+    start_time = time.time()
+    request_id = uuid.uuid4().hex
+    trace = Trace()
+    job = None
+    
+    def spans():
+        result = trace.snapshot()
+        if job is not None and job.flight is not None:
+            result += job.flight.trace.snapshot()
+        return result
+    
+    def timed(response):
+        response.headers['Server-Timing'] = server_timing(spans(), time.time() - start_time)
+        response.headers['X-Request-ID'] = request_id
+        return response
+    
+    def respond(response, **fields):
+        log_trace(request_id, start_time, spans(), status=response.status_code, **fields)
+        return timed(response)
+    
+    parsed, error = await _read_download_request(request)
+    if error:
+        return respond(error)
+    url, quality, budget = parsed
+    platform = detect_platform(url)
+    client = _client(request)
+    try:
+        rate_limiter.acquire(client)
+    except RateLimited as e:
+        return respond(_rate_limited(e), platform=platform, client=client.id)
+
+    try:
+        with trace.span('admit'):
+            job = await _submit(url, quality, budget, client)
+    except PoolSaturated as e:
+        return respond(_busy(e), platform=platform)
+
+    try:
+        with trace.span('wait'):
+            file_path, title = await wait_for_job(job, DOWNLOAD_TIMEOUT)
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+    except TimeoutError:
+        DOWNLOAD_TIMEOUTS.labels(platform).inc()
+        process_jobs.discard(job)
+        return respond(_error('Download timeout', 408), platform=platform)
+    except PoolSaturated as e:
+        process_jobs.discard(job)
+        return respond(_busy(e), platform=platform)
+    except FormatTooLarge as e:
+        process_jobs.discard(job)
+        return respond(_error(str(e), 413), platform=platform)
+    except Exception as e:
+        process_jobs.discard(job)
+        processing_time = round(time.time() - start_time, 2)
+        logger.error(f"[{request_id}] Error: {e} ({processing_time}s)")
+        return respond(_error('Video indirilemedi', 500, processing_time=processing_time),
+                       platform=platform, error=str(e))
+
+    cache_hit = job.cached is not None
+    
+    def closed():
+        process_jobs.discard(job)
+        log_trace(request_id, start_time, spans(), platform=platform, mode='file',
+                  cache='HIT' if cache_hit else 'MISS', job_id=job.id)
+    
+    logger.info(f"[{request_id}] Success: {title} ({round(time.time() - start_time, 2)}s)")
+    return timed(_file_response(request, url, file_path, title, cache_hit, on_close=closed,
+                                trace=trace))
+
+async def download_batch(request):
+    request_id = uuid.uuid4().hex
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    urls, quality, budget, error = parse_batch_request(data)
+    if error:
+        return _error(error, 400)
+    client = _client(request)
+    try:
+        rate_limiter.acquire(client, len(urls))
+    except RateLimited as e:
+        return _rate_limited(e)
+    logger.info(f"[{request_id}] Batch started: {len(urls)} URLs")
+    # Senkron generator; Starlette onu thread havuzunda iterate eder
+    return StreamingResponse(batch_zip_stream(process_jobs, urls, quality, request_id,
+                                              budget=budget, client=client),
+                             media_type='application/zip',
+                             headers={'Content-Disposition': 'attachment; filename="reeldrop-batch.zip"',
+                                      'Cache-Control': 'no-cache',
+                                      'X-Request-ID': request_id})
+
+async def video_info(request):
+    start_time = time.time()
+    if request.method == 'POST':
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+    else:
+        data = request.query_params
+    url = str((data if hasattr(data, 'get') else {}).get('url') or '').strip()
+    if not url:
+        return _error('URL required', 400)
+    if not is_valid_url(url):
+        return _error('Invalid URL format', 400, received_url=url)
+    budget, error = FormatBudget.from_request(data)
+    if error:
+        return _error(error, 400)
+    client = _client(request)
+    try:
+        rate_limiter.acquire(client)
+    except RateLimited as e:
+        return _rate_limited(e)
+    url = await run_in_threadpool(canonicalize_url, url)
+    
+    # İndirmelerle aynı sınırlı, adil kuyruktan geçer; dolarsa 503
+    future = None
+    try:
+        if draining:
+            raise PoolSaturated(DRAIN_TIMEOUT)
+        future = process_jobs.pool.call(info_via_process, url, client=client.id,
+                                        weight=client.weight)
+        strategy, info = await asyncio.wait_for(asyncio.wrap_future(future), INFO_TIMEOUT * 2)
+    except PoolSaturated as e:
+        return _busy(e)
+    except (TimeoutError, asyncio.TimeoutError):
+        if future is not None:
+            future.cancel()
+        return _error('Extraction timeout', 408)
+    except Exception as e:
+        logger.error(f"Info error: {e}")
+        return _error('Video bilgisi alınamadı', 500)
+    # İndirmeler başka alt process'e düşebilir; info ana process'te tutulup onlara taşınır
+    info_cache.put(url, strategy, info)
+    
+    body = info_summary(info, strategy, budget)
+    body['platform'] = detect_platform(url)
+    body['processing_time'] = round(time.time() - start_time, 2)
+    return JSONResponse(body)
+
+async def cache_fill(request):
+    """Sahibi olduğumuz anahtarı indirip paylaşımlı cache'e yaz (replikalar arası)"""
+    if not peer_authorized(request.headers.get('X-Cache-Token')):
+        return _error('Forbidden', 403)
+    if not shared_cache.enabled:
+        return _error('Shared cache disabled', 404)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not data.get('url'):
+        return _error('URL required', 400)
+    budget, error = FormatBudget.from_request(data)
+    if error:
+        return _error(error, 400)
+    url, quality = data['url'], data.get('quality', 'best[height<=720]/best')
+    try:
+        job = await _submit(url, quality, budget, local_only=True)
+    except PoolSaturated as e:
+        return _busy(e)
+    deadline = fill_deadline()
+    try:
+        file_path, title = await wait_for_job(job, deadline - time.time())
+        stored = await run_in_threadpool(shared_cache.ensure_stored, job.key, file_path, title,
+                                         max(deadline - time.time(), 0))
+    except FormatTooLarge as e:
+        return _error(str(e), 413)
+    except TimeoutError:
+        return _error('Fill timeout', 504)
+    except Exception as e:
+        logger.error(f"Cache fill failed for {url}: {e}")
+        return _error('Fill failed', 502)
+    finally:
+        # Zaman aşımında indirme sürer; bitmeden bırakmak onu iptal ederdi
+        process_jobs.discard_when_done(job)
+    if not stored:
+        return _error('Shared cache write failed', 502)
+    shared_cache.filled()
+    return JSONResponse({'key': job.key, 'cache_hit': job.cached is not None})
+
+async def create_job(request):
+    parsed, error = await _read_download_request(request)
+    if error:
+        return error
+    client = _client(request)
+    try:
+        rate_limiter.acquire(client)
+        job = await _submit(*parsed, client)
+    except RateLimited as e:
+        return _rate_limited(e)
+    except PoolSaturated as e:
+        return _busy(e)
+    body = job.to_dict()
+    body['status_url'] = f'/jobs/{job.id}'
+    body['file_url'] = f'/jobs/{job.id}/file'
+    return JSONResponse(body, status_code=202)
+
+async def job_status(request):
+    job = process_jobs.get(request.path_params['job_id'])
+    if not job:
+        return _error('Job not found', 404)
+    return JSONResponse(job.to_dict())
+
+async def job_file(request):
+    job = process_jobs.get(request.path_params['job_id'])
+    if not job:
+        return _error('Job not found', 404)
+    status = job.status
+    if status == 'failed':
+        return JSONResponse(job.to_dict(), status_code=500)
+    if status != 'finished':
+        return JSONResponse(job.to_dict(), status_code=409)
+    file_path, title = job.wait(0)
+    if not os.path.exists(file_path):
+        return _error('Result expired', 410)
+    return _file_response(request, job.url, file_path, title, job.cached is not None)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    logger.info(f"ASGI mode: {PROCESS_WORKERS} download processes")
+    yield
+    # Graceful shutdown: yeni iş alma, uçuştaki indirmeler bitsin
+    global draining
+    draining = True
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DRAIN_TIMEOUT
+    while loop.time() < deadline:
+        pool = process_jobs.pool.stats()
+        if not pool['active'] and not pool['queued']:
+            break
+        logger.info(f"Draining {pool['active']} active / {pool['queued']} queued downloads...")
+        await asyncio.sleep(1)
+    await run_in_threadpool(process_pool.shutdown, wait=True, cancel_futures=True)
+    logger.info("ASGI shutdown complete")
+
+app = Starlette(
+    routes=[
+        Route('/', home),
+        Route('/health', health),
+        Route('/proxy-status', proxy_status),
+        Route('/stats', stats),
+        Route('/metrics', metrics),
+        Route('/download', download_video, methods=['POST']),
+        Route('/download/batch', download_batch, methods=['POST']),
+        Route('/info', video_info, methods=['GET', 'POST']),
+        Route('/cache/fill', cache_fill, methods=['POST']),
+        Route('/jobs', create_job, methods=['POST']),
+        Route('/jobs/{job_id}', job_status),
+        Route('/jobs/{job_id}/file', job_file),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Offline yük testi: yerel sahte medya sunucusu + /download sürücüsü
+#
+#   python bench.py --size 5M --latency 0.2 --requests 40 --concurrency 8 --save base.json
+#   python bench.py ... --compare base.json
+#
+# API, Procfile'daki gibi ayrı bir process olarak başlatılır (gunicorn ya da
+# --server asgi ile uvicorn); böylece RSS ve temp disk kullanımı ölçülebilir.
+# Yerel adresler bilinen bir platforma uymadığı için istekler generic
+# extractor yolundan geçer.
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.server
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BLOCK = os.urandom(64 * 1024)
+
+def parse_size(value):
+    """'5M', '300K', '1G' ya da bayt sayısı"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    """Sabit boyutlu sentetik video; gecikme ve bant genişliği ayarlanabilir"""
+
+    protocol_version = 'HTTP/1.1'
+    size = 0
+    latency = 0.0
+    rate = 0  # bayt/sn, 0 = sınırsız
+    hits = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def do_GET(self):
+        self._send(True)
+
+    def _send(self, body):
+        with MediaHandler.lock:
+            MediaHandler.hits += 1
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(self.size))
+        self.end_headers()
+        if not body:
+            return
+        sent = 0
+        started = time.time()
+        try:
+            while sent < self.size:
+                chunk = BLOCK[:min(len(BLOCK), self.size - sent)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if self.rate:
+                    ahead = sent / self.rate - (time.time() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def start_media_server(size, latency, rate):
+    handler = type('Handler', (MediaHandler,), {'size': size, 'latency': latency, 'rate': rate})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class ResourceSampler:
+    """Sunucu process ağacının RSS'ini ve temp klasörünün boyutunu örnekle"""
+
+    def __init__(self, pid, scratch, interval=0.1):
+        self.pid = pid
+        self.scratch = scratch
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _tree(self):
+        pids = [self.pid]
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/task/{pid}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def _rss(self):
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                pass
+        return total
+
+    def _disk(self):
+        # Kök seviyedeki log dosyaları sayılmaz; temp ve cache klasörleri alt dizinlerdedir
+        total = 0
+        for root, _, files in os.walk(self.scratch):
+            if root == self.scratch:
+                continue
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _run(self):
+        while not self.stop.is_set():
+            self.peak_rss = max(self.peak_rss, self._rss())
+            self.peak_disk = max(self.peak_disk, self._disk())
+            self.stop.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+def start_api(args, scratch):
+    # cwd scratch: app.log depoyu kirletmesin
+    repo = os.path.dirname(os.path.abspath(__file__))
+    port = free_port()
+    # Tüm istekler tek IP'den gelir; istemci kotası ölçümü bozmasın (--env ile açılabilir)
+    env = dict(os.environ, PORT=str(port), TMPDIR=scratch, CLIENT_RATE='0',
+               CACHE_DIR=os.path.join(scratch, 'cache'), **dict(args.env))
+    if args.server == 'asgi':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--app-dir', repo,
+               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '--pythonpath', repo, '--bind', f'127.0.0.1:{port}',
+               f'--workers={args.workers}', f'--threads={args.threads}', 'app:app']
+    log = open(os.path.join(scratch, 'server.log'), 'wb')
+    proc = subprocess.Popen(cmd, cwd=scratch, env=env, stdout=log, stderr=subprocess.STDOUT)
+    api = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"API exited early, see {log.name}")
+        try:
+            if requests.get(api + '/health', timeout=1).ok:
+                return proc, api
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("API did not become healthy in 30s")
+
+def one_request(api, url, body):
+    """Tek /download: (durum, toplam sn, TTFB sn, bayt)"""
+    started = time.time()
+    ttfb = None
+    size = 0
+    try:
+        with requests.post(api + '/download', json={'url': url, **body},
+                           stream=True, timeout=300) as r:
+            for chunk in r.iter_content(256 * 1024):
+                if ttfb is None:
+                    ttfb = time.time() - started
+                size += len(chunk)
+            status = r.status_code
+    except requests.RequestException:
+        status = 0
+    return status, time.time() - started, ttfb, size
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    # nearest-rank
+    index = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return round(values[index], 4)
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r[0] == 200]
+    latencies = [r[1] for r in ok]
+    ttfbs = [r[2] for r in ok if r[2] is not None]
+    total_bytes = sum(r[3] for r in ok)
+    summary = {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': len(results) - len(ok),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed else None,
+        'throughput_mbps': round(total_bytes / elapsed / 1024 ** 2, 3) if elapsed else None
+    }
+    for p in (50, 95, 99):
+        summary[f'latency_p{p}_s'] = percentile(latencies, p)
+        summary[f'ttfb_p{p}_s'] = percentile(ttfbs, p)
+    return summary
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Karşılaştırmada düşük olanın iyi olduğu metrikler
+LOWER_IS_BETTER = ('latency_', 'ttfb_', 'peak_', 'errors', 'elapsed_s', 'origin_hits')
+
+def compare(current, baseline):
+    print(f"\nComparison against {baseline.get('revision') or 'baseline'}:")
+    for key, value in current['metrics'].items():
+        old = baseline.get('metrics', {}).get(key)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+            continue
+        if old:
+            change = (value - old) / old * 100
+            better = (change < 0) == key.startswith(LOWER_IS_BETTER)
+            mark = '' if abs(change) < 2 else (' better' if better else ' WORSE')
+            print(f"  {key:20} {old:>12} -> {value:<12} {change:+7.1f}%{mark}")
+        else:
+            print(f"  {key:20} {old:>12} -> {value}")
+
+def main():
+    parser = argparse.ArgumentParser(description='ReelDrop offline benchmark')
+    parser.add_argument('--size', type=parse_size, default=parse_size('5M'), help='video size (e.g. 300K, 5M)')
+    parser.add_argument('--latency', type=float, default=0.0, help='media server first-byte delay (s)')
+    parser.add_argument('--rate', type=parse_size, default=0, help='media server bandwidth per connection (bytes/s)')
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--same-url', action='store_true', help='every request asks for the same video (cache/coalescing)')
+    parser.add_argument('--stream', action='store_true', help='request pass-through streaming')
+    parser.add_argument('--server', choices=('gunicorn', 'asgi'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--env', action='append', default=[], type=lambda kv: tuple(kv.split('=', 1)),
+                        metavar='KEY=VALUE', help='extra environment for the API process')
+    parser.add_argument('--save', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='compare against a saved JSON baseline')
+    args = parser.parse_args()
+
+    media = start_media_server(args.size, args.latency, args.rate)
+    scratch = tempfile.mkdtemp(prefix='reeldrop-bench-')
+    proc, api = start_api(args, scratch)
+    media_base = f'http://127.0.0.1:{media.server_port}'
+    body = {'stream': True} if args.stream else {'stream': False}
+    urls = [f'{media_base}/{"same" if args.same_url else i}.mp4' for i in range(args.requests)]
+
+    print(f"Benchmark: {args.requests} requests x {args.concurrency} concurrent, "
+          f"{args.size} byte videos, server={args.server}")
+    try:
+        with ResourceSampler(proc.pid, scratch) as sampler:
+            started = time.time()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                results = list(pool.map(lambda url: one_request(api, url, body), urls))
+            elapsed = time.time() - started
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        media.shutdown()
+
+    metrics = summarize(results, elapsed)
+    metrics['peak_rss_mb'] = round(sampler.peak_rss / 1024 ** 2, 1)
+    metrics['peak_temp_disk_mb'] = round(sampler.peak_disk / 1024 ** 2, 1)
+    metrics['origin_hits'] = MediaHandler.hits
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {k: v for k, v in vars(args).items() if k not in ('save', 'compare')},
+        'metrics': metrics
+    }
+    print(json.dumps(metrics, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import copy
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app import edilmeden önce: log dosyası, cache ve scratch geçici klasöre
+_root = tempfile.mkdtemp(prefix='reeldrop-test-')
+os.environ.setdefault('LOG_FILE', '')
+os.environ.setdefault('CACHE_DIR', os.path.join(_root, 'cache'))
+os.environ.setdefault('SCRATCH_DIR', os.path.join(_root, 'scratch'))
+os.environ.setdefault('CLIENT_RATE', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MEDIA_INFO = {
+    'id': 'clip',
+    'title': 'clip',
+    'extractor': 'test',
+    'extractor_key': 'Test',
+    'webpage_url': 'http://media.test/clip',
+    'formats': [
+        {'format_id': 'lo', 'url': 'http://media.test/lo.mp4', 'ext': 'mp4', 'height': 240,
+         'vcodec': 'h264', 'acodec': 'aac', 'filesize': 1000},
+        {'format_id': 'hi', 'url': 'http://media.test/hi.mp4', 'ext': 'mp4', 'height': 720,
+         'vcodec': 'h264', 'acodec': 'aac', 'filesize': 9000},
+    ],
+}
+
+
+@pytest.fixture
+def media_info():
+    """İki progressive formatlı (lo 240p/1000 B, hi 720p/9000 B) extract sonucu"""
+    return copy.deepcopy(MEDIA_INFO)
@@ -0,0 +1,61 @@
+import io
+import json
+import zipfile
+
+import app
+from app import batch_zip_stream
+
+
+class _Flight:
+    def __init__(self):
+        self.callbacks = []
+
+    def add_done_callback(self, fn):
+        self.callbacks.append(fn)
+
+
+class _Job:
+    def __init__(self, path=None):
+        self.path = path
+        self.cached = (path, 'clip') if path else None
+        self.flight = None if path else _Flight()
+
+    def wait(self, timeout=None):
+        return self.cached
+
+
+class StubJobs:
+    """İlk `ready` URL hemen biter, kalanlar hiç bitmez"""
+
+    def __init__(self, path, ready):
+        self.path = path
+        self.ready = ready
+        self.submitted = 0
+        self.discarded = 0
+
+    def submit(self, url, quality, budget=None, client=None):
+        self.submitted += 1
+        return _Job(self.path if self.submitted <= self.ready else None)
+
+    def discard(self, job):
+        self.discarded += 1
+
+
+def read_manifest(chunks):
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        return archive.namelist(), json.loads(archive.read('manifest.json'))['entries']
+
+
+def test_timeout_fails_active_and_pending_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DOWNLOAD_TIMEOUT', 0.05)
+    video = tmp_path / 'clip.mp4'
+    video.write_bytes(b'\0' * 100)
+    urls = [f'https://media.example.com/{i}.mp4' for i in range(6)]
+    jobs = StubJobs(str(video), ready=1)
+
+    names, manifest = read_manifest(batch_zip_stream(jobs, urls, 'best', 'req', concurrency=2))
+
+    assert [entry['status'] for entry in manifest] == ['ok'] + ['failed'] * 5
+    assert [entry['error'] for entry in manifest[1:]] == ['Download timeout'] * 2 + ['Batch timeout'] * 3
+    assert names == ['01_clip.mp4', 'manifest.json']
+    assert jobs.discarded == jobs.submitted == 3
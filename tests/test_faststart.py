@@ -0,0 +1,68 @@
+import struct
+
+import pytest
+
+from app import _shift_chunk_offsets, faststart_mp4, sniff_media
+
+
+def box(kind, *children):
+    body = b''.join(children)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def stco(*offsets):
+    return box(b'stco', struct.pack('>II', 0, len(offsets)), *(struct.pack('>I', o) for o in offsets))
+
+
+def co64(*offsets):
+    return box(b'co64', struct.pack('>II', 0, len(offsets)), *(struct.pack('>Q', o) for o in offsets))
+
+
+def moov(*tables):
+    return box(b'moov', box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', *tables)))))
+
+
+def chunk_offsets(data):
+    """Dosyadaki tüm stco/co64 offset'leri (dosya sırasıyla)"""
+    found = []
+    for kind, width, fmt in ((b'stco', 4, '>I'), (b'co64', 8, '>Q')):
+        at = data.find(kind)
+        if at < 0:
+            continue
+        count = struct.unpack_from('>I', data, at + 8)[0]
+        found += [struct.unpack_from(fmt, data, at + 12 + i * width)[0] for i in range(count)]
+    return found
+
+
+def test_shift_patches_stco_and_co64():
+    data = bytearray(moov(stco(100, 200), co64(2 ** 33)))
+    _shift_chunk_offsets(data, 50)
+    assert chunk_offsets(bytes(data)) == [150, 250, 2 ** 33 + 50]
+
+
+def test_shift_rejects_stco_overflow():
+    with pytest.raises(ValueError):
+        _shift_chunk_offsets(bytearray(moov(stco(0xFFFFFFF0))), 0x20)
+
+
+def test_shift_rejects_compressed_moov():
+    with pytest.raises(ValueError):
+        _shift_chunk_offsets(bytearray(box(b'moov', box(b'cmov', b'\0' * 8))), 10)
+
+
+def test_faststart_moves_moov_and_keeps_offsets_on_the_same_samples(tmp_path):
+    ftyp = box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isommp41')
+    samples = [b'AAAA', b'BBBB', b'CCCC']
+    mdat_start = len(ftyp) + 8
+    offsets = [mdat_start + 4 * i for i in range(3)]
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(ftyp + box(b'mdat', *samples) + moov(stco(*offsets[:2]), co64(offsets[2])))
+
+    assert faststart_mp4(str(path)) is True
+    data = path.read_bytes()
+    assert data.index(b'moov') < data.index(b'mdat')
+    assert [data[o:o + 4] for o in chunk_offsets(data)] == samples
+    # Zaten fast-start olan dosyaya dokunulmaz
+    assert faststart_mp4(str(path)) is False
+    with open(path, 'rb') as f:
+        assert sniff_media(f) == ('mp4', 'video/mp4')
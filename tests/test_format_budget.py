@@ -0,0 +1,42 @@
+import copy
+import os
+
+import pytest
+import yt_dlp
+
+from app import FormatBudget, FormatTooLarge, SimpleDownloader
+
+
+def test_select_picks_best_format_that_fits(media_info):
+    assert FormatBudget(max_bytes=10000).select(copy.deepcopy(media_info))['format_id'] == 'hi'
+    assert FormatBudget(max_bytes=5000).select(copy.deepcopy(media_info))['format_id'] == 'lo'
+    assert FormatBudget(max_height=480).select(copy.deepcopy(media_info))['format_id'] == 'lo'
+
+
+def test_select_raises_when_nothing_fits(media_info):
+    with pytest.raises(FormatTooLarge):
+        FormatBudget(max_bytes=10).select(copy.deepcopy(media_info))
+
+
+@pytest.mark.parametrize('budget, expected', [(None, 'lo'), (FormatBudget(max_bytes=10000), 'hi')])
+def test_budget_format_is_the_one_downloaded(tmp_path, media_info, budget, expected):
+    downloaded = []
+    ydl = yt_dlp.YoutubeDL({'quiet': True, 'format': 'worst',
+                            'outtmpl': {'default': str(tmp_path / 'x.%(ext)s')}})
+
+    def process_info(info):
+        # Ağa çıkmadan yt_dlp'nin indirmeye verdiği formatı kaydet
+        downloaded.append(info['format_id'])
+        with open(os.path.join(tmp_path, f"clip.{info['ext']}"), 'wb') as f:
+            f.write(b'\0' * 2048)
+
+    ydl.process_info = process_info
+    downloader = SimpleDownloader(budget=budget)
+    result = downloader._download_info(ydl, 'test', copy.deepcopy(media_info), str(tmp_path), 'clip',
+                                       require_formats=True, min_size=1024)
+
+    assert result is not None
+    assert downloaded == [expected]
+    # Havuza dönen instance stratejinin formatına geri döner
+    assert ydl.params['format'] == 'worst'
+    assert ydl.process_ie_result(copy.deepcopy(media_info), download=False)['format_id'] == 'lo'
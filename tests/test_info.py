@@ -0,0 +1,49 @@
+import pytest
+
+import app
+from app import DownloadPool, SimpleDownloader, info_cache
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+@pytest.fixture(autouse=True)
+def clean_info_cache():
+    info_cache.entries.clear()
+    yield
+    info_cache.entries.clear()
+
+
+def names(attempts):
+    return [name for name, _, _ in attempts]
+
+
+def attempts():
+    return ((name, {}, URL) for name in ('first', 'second', 'third', 'fourth'))
+
+
+def test_order_is_unchanged_without_cached_info():
+    assert names(SimpleDownloader._cached_first(attempts())) == ['first', 'second', 'third', 'fourth']
+
+
+def test_strategy_cached_by_info_runs_first():
+    info_cache.put(URL, 'third', {'id': 'x'})
+    assert names(SimpleDownloader._cached_first(attempts())) == ['third', 'first', 'second', 'fourth']
+
+
+def test_cached_info_for_another_url_is_ignored():
+    info_cache.put('https://www.youtube.com/watch?v=other', 'third', {'id': 'x'})
+    assert names(SimpleDownloader._cached_first(attempts())) == ['first', 'second', 'third', 'fourth']
+
+
+def test_pool_call_returns_result_and_error():
+    pool = DownloadPool(1, 4)
+    assert pool.call(lambda a, b: a + b, 2, 3).result(5) == 5
+    with pytest.raises(ZeroDivisionError):
+        pool.call(lambda: 1 / 0).result(5)
+
+
+def test_info_is_rejected_when_the_pool_is_full(monkeypatch):
+    monkeypatch.setattr(app.download_jobs, 'pool', DownloadPool(0, 0))
+    response = app.app.test_client().get('/info', query_string={'url': URL})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from app import ResultCache, app, file_etag, file_response, parse_byte_ranges
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('', None),
+    ('items=0-1', None),
+    ('bytes=0-99', [(0, 100)]),
+    ('bytes=900-', [(900, 1000)]),
+    ('bytes=-100', [(900, 1000)]),
+    ('bytes=-5000', [(0, 1000)]),
+    ('bytes=990-2000', [(990, 1000)]),
+    ('bytes=0-0, 10-19', [(0, 1), (10, 20)]),
+    ('bytes=10-19, 0-0', [(0, 1), (10, 20)]),
+    ('bytes=0-49, 40-99, 100-109', [(0, 110)]),
+    ('bytes=0-499, 400-899', [(0, 900)]),
+    ('bytes=0-, 0-', None),
+    (','.join(['bytes=0-0'] + [f'{i}-{i}' for i in range(2, 40, 2)]), None),
+    ('bytes=5000-', []),
+    ('bytes=10-5', None),
+    ('bytes=abc-', None),
+    ('bytes=5', None),
+])
+def test_parse_byte_ranges(header, expected):
+    assert parse_byte_ranges(header, SIZE) == expected
+
+
+@pytest.fixture
+def cached_file(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 10 ** 7, 3600)
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(os.urandom(SIZE))
+    path = cache.put('k', str(source), 'title')
+    return cache, path
+
+
+def test_etag_is_stable_across_cache_hits(cached_file):
+    cache, path = cached_file
+    etag = file_etag(path)
+    mtime = os.stat(path).st_mtime_ns
+    for _ in range(3):
+        assert cache.get('k') == (path, 'title')
+    assert os.stat(path).st_mtime_ns == mtime
+    assert file_etag(path) == etag
+
+
+def serve(path, headers):
+    with app.test_request_context(headers=headers):
+        response = file_response(path, 'title', True)
+        body = b''.join(response.response)
+        response.close()
+        return response, body
+
+
+def test_if_range_resumes_after_cache_hit(cached_file):
+    cache, path = cached_file
+    first, _ = serve(path, {})
+    cache.get('k')
+    response, body = serve(path, {'Range': 'bytes=100-', 'If-Range': first.headers['ETag']})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-{SIZE - 1}/{SIZE}'
+    assert len(body) == SIZE - 100
+
+
+def test_if_range_mismatch_sends_whole_file(cached_file):
+    _, path = cached_file
+    response, body = serve(path, {'Range': 'bytes=100-', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert len(body) == SIZE
+
+
+def test_repeated_ranges_are_not_amplified(cached_file):
+    _, path = cached_file
+    response, body = serve(path, {'Range': 'bytes=' + ','.join(['0-'] * 500)})
+    assert response.status_code == 200
+    assert int(response.headers['Content-Length']) == len(body) == SIZE
+
+
+def test_unsatisfiable_range(cached_file):
+    _, path = cached_file
+    response, _ = serve(path, {'Range': f'bytes={SIZE}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
@@ -0,0 +1,42 @@
+import uuid
+
+import pytest
+
+import app
+from app import ClientQuota, RateLimited, RateLimiter
+
+
+@pytest.fixture(autouse=True)
+def api_keys(monkeypatch):
+    monkeypatch.setattr(app, 'API_KEYS', {'vip': {'rate': 5, 'burst': 50, 'weight': 4}})
+
+
+def test_known_key_gets_its_own_quota():
+    client = ClientQuota.resolve('vip', '10.0.0.1')
+    assert client.id.startswith('key:') and 'vip' not in client.id
+    assert (client.rate, client.burst, client.weight) == (5.0, 50, 4.0)
+
+
+def test_unknown_keys_fall_back_to_the_ip():
+    ids = {ClientQuota.resolve(uuid.uuid4().hex, '10.0.0.1').id for _ in range(5)}
+    assert ids == {'ip:10.0.0.1'}
+
+
+def test_rotating_unknown_keys_does_not_bypass_the_limit():
+    limiter = RateLimiter()
+    results = []
+    for _ in range(3):
+        client = ClientQuota.resolve(uuid.uuid4().hex, '10.0.0.1')
+        client.rate, client.burst = 0.01, 1
+        try:
+            limiter.acquire(client)
+            results.append(200)
+        except RateLimited:
+            results.append(429)
+    assert results == [200, 429, 429]
+
+
+def test_forwarded_for_uses_the_rightmost_trusted_hop(monkeypatch):
+    monkeypatch.setattr(app, 'TRUSTED_PROXY_HOPS', 1)
+    client = ClientQuota.resolve(None, '127.0.0.1', '1.2.3.4, 203.0.113.7')
+    assert client.id == 'ip:203.0.113.7'
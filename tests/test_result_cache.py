@@ -0,0 +1,16 @@
+from app import FormatBudget, video_cache_key
+
+
+def test_cache_key_ignores_quality_for_platform_handlers():
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    assert video_cache_key(url, 'best') == video_cache_key(url, 'worst[ext=mp4]')
+
+
+def test_cache_key_keeps_quality_for_generic_urls():
+    url = 'https://media.example.com/clip.mp4'
+    assert video_cache_key(url, 'best') != video_cache_key(url, 'worst')
+
+
+def test_cache_key_includes_budget():
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+    assert video_cache_key(url, 'best') != video_cache_key(url, 'best', FormatBudget(max_bytes=1000))
@@ -0,0 +1,118 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+import app
+from app import DownloadPool, HashRing, JobManager, SharedCache, SharedDirBackend, peer_authorized
+
+NODES = [f'http://replica-{i}:8080' for i in range(4)]
+KEYS = [f'{i:064x}' for i in range(2000)]
+
+
+def test_ring_owner_is_stable_and_ignores_node_order():
+    ring = HashRing(NODES)
+    assert [ring.owner(k) for k in KEYS] == [HashRing(list(reversed(NODES))).owner(k) for k in KEYS]
+    assert HashRing([]).owner(KEYS[0]) is None
+
+
+def test_ring_spreads_keys_and_only_moves_keys_of_removed_node():
+    ring = HashRing(NODES)
+    owners = [ring.owner(k) for k in KEYS]
+    for node in NODES:
+        assert owners.count(node) > len(KEYS) / len(NODES) / 2
+
+    smaller = HashRing(NODES[:-1])
+    moved = sum(1 for k, owner in zip(KEYS, owners) if owner != NODES[-1] and smaller.owner(k) != owner)
+    assert moved == 0
+
+
+def test_shared_dir_roundtrip_and_ttl(tmp_path):
+    backend = SharedDirBackend(str(tmp_path / 'shared'), ttl=60)
+    key = KEYS[0]
+    assert not backend.exists(key)
+    backend.store(key, io.BytesIO(b'video'), 'Başlık')
+    dest = tmp_path / 'out'
+    assert backend.fetch(key, str(dest)) == 'Başlık'
+    assert dest.read_bytes() == b'video'
+    assert not [n for n in os.listdir(tmp_path / 'shared' / key[:2]) if '.tmp-' in n]
+
+    backend.ttl = 0
+    time.sleep(0.01)
+    assert backend.fetch(key, str(dest)) is None
+
+
+def test_peer_route_fails_closed_without_token(monkeypatch):
+    monkeypatch.setattr(app, 'CACHE_PEER_TOKEN', '')
+    assert not peer_authorized('')
+    assert not peer_authorized(None)
+    response = app.app.test_client().post('/cache/fill', json={'url': 'https://example.com/a.mp4'})
+    assert response.status_code == 403
+
+
+def test_peer_route_checks_token(monkeypatch):
+    monkeypatch.setattr(app, 'CACHE_PEER_TOKEN', 's3cret')
+    assert peer_authorized('s3cret')
+    assert not peer_authorized('wrong')
+
+
+def test_fill_timeout_keeps_owner_download_running(monkeypatch, tmp_path):
+    backend = SharedDirBackend(str(tmp_path / 'shared'), ttl=60)
+    monkeypatch.setattr(app, 'CACHE_PEER_TOKEN', 's3cret')
+    monkeypatch.setattr(app, 'shared_cache', SharedCache(backend, HashRing([]), '', 's3cret'))
+    monkeypatch.setattr(app, 'fill_deadline', lambda: time.time() + 0.2)
+    gate, flights = threading.Event(), []
+
+    def slow_download(url, quality, flight, budget=None):
+        flights.append(flight)
+        gate.wait(5)
+        temp_dir = app.scratch.create()
+        path = os.path.join(temp_dir, 'clip.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'video')
+        return path, 'clip'
+
+    monkeypatch.setattr(app, 'download_jobs', JobManager(DownloadPool(1, 4), 60, download=slow_download))
+    response = app.app.test_client().post('/cache/fill', headers={'X-Cache-Token': 's3cret'},
+                                          json={'url': f'https://media.example.com/{time.time()}.mp4'})
+    assert response.status_code == 504
+
+    # Son istek gitti ama indirme iptal edilmedi; bitince paylaşımlı cache'e yazılır
+    flight, = flights
+    assert not flight.cancelled.is_set()
+    gate.set()
+    assert flight.event.wait(5) and flight.error is None
+    deadline = time.time() + 5
+    while not backend.exists(flight.key) and time.time() < deadline:
+        time.sleep(0.01)
+    assert backend.exists(flight.key)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip('moto')
+    import boto3
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='reeldrop')
+        yield app.S3Backend('reeldrop', 'test/', 60, region='us-east-1')
+
+
+def test_s3_roundtrip_and_miss(s3, tmp_path):
+    key = KEYS[1]
+    dest = str(tmp_path / 'out')
+    assert s3.fetch(key, dest) is None
+    s3.store(key, io.BytesIO(b'video'), 'Başlık')
+    assert s3.exists(key)
+    assert s3.fetch(key, dest) == 'Başlık'
+
+
+def test_s3_errors_other_than_404_are_not_misses(s3):
+    from botocore.stub import Stubber
+    with Stubber(s3.client) as stub:
+        stub.add_client_error('head_object', service_error_code='AccessDenied', http_status_code=403)
+        with pytest.raises(s3.client_error):
+            s3.exists(KEYS[2])
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import ShortLinkResolver
+
+SHORT = 'https://fb.watch/abc123/'
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    resolver = ShortLinkResolver(ttl=3600)
+    calls = []
+
+    def head(url, **kwargs):
+        calls.append(url)
+        return resolver.next_response
+
+    monkeypatch.setattr(resolver.session, 'head', head)
+    resolver.calls = calls
+    return resolver
+
+
+def respond(resolver, status, url):
+    resolver.next_response = SimpleNamespace(status_code=status, url=url)
+
+
+def test_supported_target_is_cached(resolver):
+    target = 'https://www.facebook.com/watch/?v=123'
+    respond(resolver, 200, target)
+    assert resolver.resolve(SHORT) == target
+    assert resolver.resolve(SHORT) == target
+    assert len(resolver.calls) == 1
+
+
+def test_login_redirect_is_not_cached(resolver):
+    respond(resolver, 200, 'https://www.facebook.com/login/?next=x')
+    assert resolver.resolve(SHORT) == SHORT
+    assert resolver.stats()['entries'] == 0
+
+    # Sonraki deneme yeniden çözer
+    target = 'https://www.facebook.com/watch/?v=123'
+    respond(resolver, 200, target)
+    assert resolver.resolve(SHORT) == target
+
+
+def test_error_status_is_not_cached(resolver):
+    respond(resolver, 404, 'https://www.facebook.com/watch/?v=123')
+    assert resolver.resolve(SHORT) == SHORT
+    assert resolver.stats()['entries'] == 0
+    assert resolver.stats()['rejected'] == 1
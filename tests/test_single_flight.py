@@ -0,0 +1,86 @@
+import threading
+
+from app import SingleFlight
+
+
+def make_flights():
+    cleaned = []
+    return SingleFlight(cleanup=cleaned.append), cleaned
+
+
+def test_followers_share_the_leader_flight():
+    flights, _ = make_flights()
+    a, leader_a = flights.join('k')
+    b, leader_b = flights.join('k')
+    assert leader_a and not leader_b
+    assert a is b
+
+
+def test_join_after_cancel_starts_a_new_flight():
+    flights, _ = make_flights()
+    old, _ = flights.join('k')
+    flights.release(old)
+    assert old.cancelled.is_set()
+
+    new, leader = flights.join('k')
+    assert leader and new is not old
+
+    # Eski lider iptalini bitirirken yeni uçuşu haritadan silmemeli
+    flights.run(old, lambda flight: ('a', 't', None))
+    assert old.error is not None
+    assert flights.join('k')[0] is new
+
+    flights.run(new, lambda flight: ('path', 'title', None))
+    assert new.error is None and new.result[0] == 'path'
+
+
+def test_cleanup_runs_once_when_last_reader_leaves_after_finish():
+    flights, cleaned = make_flights()
+    flight, _ = flights.join('k')
+    flights.run(flight, lambda f: ('p', 't', 'dir'))
+    assert cleaned == []
+    flights.release(flight)
+    assert cleaned == [('p', 't', 'dir')]
+
+
+def test_cleanup_runs_once_when_orphaned_during_run():
+    flights, cleaned = make_flights()
+    flight, _ = flights.join('k')
+    started = threading.Event()
+    proceed = threading.Event()
+
+    def fn(f):
+        started.set()
+        proceed.wait(5)
+        return 'p', 't', 'dir'
+
+    runner = threading.Thread(target=flights.run, args=(flight, fn))
+    runner.start()
+    started.wait(5)
+    flights.release(flight)
+    proceed.set()
+    runner.join(5)
+    assert cleaned == [('p', 't', 'dir')]
+
+
+def test_cleanup_exactly_once_under_concurrent_release():
+    for _ in range(200):
+        flights, cleaned = make_flights()
+        flight, _ = flights.join('k')
+        barrier = threading.Barrier(2)
+
+        def finish():
+            barrier.wait()
+            flights.run(flight, lambda f: ('p', 't', 'dir'))
+
+        def leave():
+            barrier.wait()
+            flights.release(flight)
+
+        threads = [threading.Thread(target=finish), threading.Thread(target=leave)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        # İptal, run başlamadan gelirse sonuç yoktur; yoksa tam bir kez temizlenir
+        assert len(cleaned) == (0 if flight.error else 1)
@@ -0,0 +1,44 @@
+import os
+import threading
+
+from app import DownloadJob, _Flight, app, stream_response
+
+
+def streaming_job(part_path):
+    job = DownloadJob('https://media.example.com/a.mp4', 'best', 'k')
+    job.flight = _Flight('k')
+    job.flight.stream_path, job.flight.stream_title = str(part_path), 'clip'
+    job.flight.stream_ready.set()
+    return job
+
+
+def test_stream_survives_part_rename(tmp_path):
+    part = tmp_path / 'clip.mp4.part'
+    part.write_bytes(b'a' * 1000)
+    job = streaming_job(part)
+
+    source, title, streaming = job.wait_stream(1)
+    assert streaming
+    # yt_dlp bitirip yeniden adlandırdı, gövde henüz okunmadı
+    os.rename(part, tmp_path / 'clip.mp4')
+    job.flight.result = (str(tmp_path / 'clip.mp4'), 'clip', None)
+    job.flight._finish()
+
+    with app.test_request_context():
+        response = stream_response(job.flight, source, title)
+        assert b''.join(response.response) == b'a' * 1000
+        response.close()
+    assert source.closed
+
+
+def test_renamed_part_falls_back_to_the_finished_file(tmp_path):
+    final = tmp_path / 'clip.mp4'
+    final.write_bytes(b'a' * 1000)
+    job = streaming_job(tmp_path / 'clip.mp4.part')
+
+    def finish():
+        job.flight.result = (str(final), 'clip', None)
+        job.flight._finish()
+
+    threading.Timer(0.1, finish).start()
+    assert job.wait_stream(5) == (str(final), 'clip', False)
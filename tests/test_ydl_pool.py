@@ -0,0 +1,29 @@
+import copy
+
+from app import YDLPool
+
+
+def opts(fmt):
+    return {'quiet': True, 'outtmpl': {'default': '/tmp/%(id)s.%(ext)s'}, 'format': fmt}
+
+
+def selected(ydl, info):
+    return ydl.process_ie_result(info, download=False)['format_id']
+
+
+def test_reused_instance_honours_the_new_format(media_info):
+    pool = YDLPool(max_idle=2, idle_ttl=60)
+    with pool.lease(opts('worst')) as ydl:
+        first = ydl
+        assert selected(ydl, copy.deepcopy(media_info)) == 'lo'
+    with pool.lease(opts('best')) as ydl:
+        assert ydl is first
+        assert selected(ydl, copy.deepcopy(media_info)) == 'hi'
+    assert pool.stats()['reused'] == 1
+
+
+def test_set_format_rebuilds_selector(media_info):
+    pool = YDLPool(max_idle=1, idle_ttl=60)
+    with pool.lease(opts('best')) as ydl:
+        YDLPool.set_format(ydl, 'lo')
+        assert selected(ydl, copy.deepcopy(media_info)) == 'lo'